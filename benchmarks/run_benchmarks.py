@@ -0,0 +1,237 @@
+#! python3
+
+"""
+Benchmarks for RPGenie's hot paths
+
+Every scenario runs at several sizes against generated data files and reports
+its throughput and peak memory use (measured with tracemalloc in a separate
+run, so that tracing doesn't skew the timings).
+
+Usage:
+    python benchmarks/run_benchmarks.py                       # quick sizes
+    python benchmarks/run_benchmarks.py --full                # every size
+    python benchmarks/run_benchmarks.py --save baseline.json  # save a baseline
+    python benchmarks/run_benchmarks.py --compare baseline.json --threshold 0.25
+
+When comparing, the script exits with status 1 if any scenario is more than
+the threshold (a fraction) slower than in the baseline. It does the same if
+a cold "import classes" takes longer than the startup budget.
+"""
+
+# Built-in libraries
+import gc
+import sys
+import json
+import time
+import shutil
+import atexit
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+from pathlib import Path
+from typing import List, Dict, Any, Callable
+
+# A workaround for the benchmarks not automatically setting
+# root/src/ as the current working directory
+path_to_src = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(path_to_src))
+
+from classes import Item, Container, Inventory, Character
+from mixins import CATALOG, DataFileMixin
+
+
+# name -> (setup, quick sizes, full sizes)
+SCENARIOS: Dict[str, tuple] = {}
+
+# Time budget for a cold "import classes", in seconds
+STARTUP_BUDGET = 0.25
+
+BENCH_DATA_DIR = Path(tempfile.mkdtemp(prefix="rpgenie-bench-"))
+atexit.register(shutil.rmtree, str(BENCH_DATA_DIR), True)
+
+
+def scenario(name: str, quick: List[int], full: List[int]) -> Callable:
+    """
+    Registers a benchmark scenario
+
+    The decorated function gets a size and returns a tuple of a callable
+    running the benchmark once, and the number of operations that run makes.
+    """
+    def decorator(setup: Callable) -> Callable:
+        SCENARIOS[name] = (setup, quick, full)
+        return setup
+    return decorator
+
+
+def item_file(count: int) -> str:
+    """ Returns an item data file with the given number of items, generating it if needed """
+    file = BENCH_DATA_DIR / f"items_{count}.json"
+    if not file.exists():
+        items = {}
+        for ID in range(count):
+            if ID % 10 == 0:
+                items[str(ID)] = {"name": f"Coin {ID}", "type": "item", "stackable": True,
+                                  "examine": ["Lovely money!", "A stack of {} coins."]}
+            elif ID % 3 == 0:
+                items[str(ID)] = {"name": f"Sword {ID}", "type": "weapon",
+                                  "examine": "A sword.", "atk": ID % 50, "def": ID % 7,
+                                  "combine2": [[ID - 1, ID + 1]]}
+            else:
+                items[str(ID)] = {"name": f"Pebble {ID}", "type": "item", "examine": "A rock."}
+        file.write_text(json.dumps({"items": items}))
+    return str(file)
+
+
+@scenario("container_append_remove", quick=[10, 1000, 10000], full=[10, 1000, 10000, 100000])
+def container_append_remove(size: int):
+    file = item_file(1000)
+    items = [Item(ID % 1000, file=file) for ID in range(size)]
+
+    def run():
+        container = Container(max_capacity=size)
+        for item in items:
+            container.append(item)
+        for item in items:
+            container.remove(item)
+    return run, 2 * size
+
+
+@scenario("item_construction", quick=[1000, 100000], full=[1000, 100000, 1000000])
+def item_construction(size: int):
+    file = item_file(1000)
+    Item(0, file=file)
+
+    def run():
+        for ID in range(size):
+            Item(ID % 1000, file=file)
+    return run, size
+
+
+@scenario("data_lookup_cold", quick=[1000, 10000], full=[1000, 100000, 1000000])
+def data_lookup_cold(size: int):
+    file = item_file(size)
+
+    def run():
+        CATALOG.invalidate(file)
+        for ID in range(size):
+            DataFileMixin._get_by_ID(ID, 'items', file)
+    return run, size
+
+
+@scenario("level_up", quick=[10**4, 10**9], full=[10**4, 10**9, 10**15])
+def level_up(size: int):
+    characters = [Character('Bench') for _ in range(1000)]
+
+    def run():
+        for character in characters:
+            character.level = 1
+            character.experience = 0
+            character.give_exp(size)
+    return run, len(characters)
+
+
+@scenario("inventory_equip", quick=[10, 1000], full=[10, 1000, 100000])
+def inventory_equip(size: int):
+    file = item_file(1000)
+    weapons = [Item(ID, file=file) for ID in range(3, 1000, 3) if ID % 10][:size]
+    weapons = (weapons * (size // len(weapons) + 1))[:size]
+
+    def run():
+        inventory = Inventory(items=list(weapons), max_capacity=size)
+        for item in weapons:
+            inventory.equip(item)
+    return run, size
+
+
+def measure(setup: Callable, size: int, repeat: int) -> Dict[str, Any]:
+    """ Runs a scenario, returning its best throughput and its peak memory use """
+    run, operations = setup(size)
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": best,
+        "ops_per_second": operations / best if best else float('inf'),
+        "peak_memory_bytes": peak,
+    }
+
+
+def measure_startup(repeat: int) -> Dict[str, Any]:
+    """ Measures how long a fresh interpreter takes to import the classes module """
+    code = ("import time; start = time.perf_counter(); import classes; "
+            "print(time.perf_counter() - start)")
+    best = float('inf')
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], cwd=str(path_to_src),
+                                stdout=subprocess.PIPE, check=True).stdout
+        best = min(best, float(output))
+    return {"seconds": best, "ops_per_second": 1 / best, "peak_memory_bytes": None}
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """ Returns a description of every result slower than its baseline by more than the threshold """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        expected = baseline[key]["ops_per_second"]
+        if result["ops_per_second"] < expected / (1 + threshold):
+            regressions.append(f"{key}: {result['ops_per_second']:.0f} ops/s, "
+                               f"baseline {expected:.0f} ops/s")
+    return regressions
+
+
+def main(argv: List[str]=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks for RPGenie's hot paths")
+    parser.add_argument("--full", action="store_true", help="run every size, including the slow ones")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per scenario; the best one counts")
+    parser.add_argument("--only", nargs="*", default=None, help="names of the scenarios to run")
+    parser.add_argument("--save", metavar="FILE", help="save the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results against a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown against the baseline, as a fraction (default: 0.2)")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET,
+                        help=f"maximum seconds a cold 'import classes' may take (default: {STARTUP_BUDGET})")
+    args = parser.parse_args(argv)
+
+    failed = False
+    results = {}
+    if not args.only or "startup" in args.only:
+        startup = results["startup"] = measure_startup(max(args.repeat, 5))
+        print(f"{'startup':<25} {'import classes':>16} {startup['seconds'] * 1000:>14.1f} ms")
+        if startup["seconds"] > args.startup_budget:
+            print(f"OVER BUDGET startup: {startup['seconds']:.3f}s, budget {args.startup_budget:.3f}s")
+            failed = True
+    for name, (setup, quick, full) in SCENARIOS.items():
+        if args.only and name not in args.only:
+            continue
+        for size in (full if args.full else quick):
+            result = results[f"{name}[{size}]"] = measure(setup, size, args.repeat)
+            print(f"{name:<25} {size:>16} {result['ops_per_second']:>14.0f} ops/s"
+                  f" {result['peak_memory_bytes'] / 1024:>12.1f} KiB peak")
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
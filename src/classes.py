@@ -1,17 +1,144 @@
 # Built-in libraries
-from copy import deepcopy
+from collections import Counter, deque
+from collections.abc import Mapping
+from contextlib import contextmanager, ExitStack
+from functools import wraps
+from itertools import islice
+from threading import RLock
+from array import array
+from types import MappingProxyType
 from abc import ABCMeta, abstractmethod
-from typing import List, Dict, Any, NewType
+from typing import List, Dict, Any, Callable, Iterable, NamedTuple, NewType, Tuple, Union
 
 # 3rd-party libraries
 # None
 
 # Local libraries
-from settings import *
-from mixins import *
+from settings import ITEM_FILE, ITEM_MAX_COUNT, JOURNAL_LIMIT
+from mixins import CATALOG, DataFileMixin, ReprMixin, StateMixin, LevelMixin, SpritesMixin
+from registry import WORLD
 
+__all__ = [
+    'ItemDefinition',
+    'Item',
+    'freeze_metadata',
+    'stack_key',
+    'Recipe',
+    'RecipeIndex',
+    'NO_LOCK',
+    'synchronized',
+    'locked',
+    'ItemMultiset',
+    'TransactionResult',
+    'Change',
+    'ChangeJournal',
+    'Container',
+    'ItemView',
+    'CompactContainer',
+    'GearLayout',
+    'Gear',
+    'Inventory',
+    'Character',
+    'Player',
+]
 
-class Item(ReprMixin, DataFileMixin):
+
+class ItemDefinition(ReprMixin):
+
+    """
+    Immutable, shared static data of a single item ID
+
+    Only one definition exists per item ID and data file; Item instances
+    refer to it instead of copying the data onto themselves.
+    """
+
+    __slots__ = ('ID',
+                 'name',
+                 'slot',
+                 'descriptions',
+                 'attack',
+                 'defence',
+                 'specialAttack',
+                 'stackable',
+                 'combinations',
+                 'combinations2',
+                 '_file',
+                 '_generation',)
+
+    # (ID, file) -> ItemDefinition
+    _definitions: Dict = {}
+
+    def __init__(self, id_num: int, item_data: Dict, file: str=ITEM_FILE, generation: int=0) -> None:
+        """ Builds a definition from the item's data file entry """
+        set_attr = super().__setattr__
+        set_attr('ID', int(id_num))
+        set_attr('name', item_data['name'])
+        set_attr('slot', item_data['type'])
+        set_attr('descriptions', item_data['examine'])
+
+        # Attributes exclusive to wearable items
+        if self.slot in Item.EQUIPMENT:
+            set_attr('attack', item_data.get('atk', None))
+            set_attr('defence', item_data.get('def', None))
+            set_attr('specialAttack', item_data.get('specialAttack', None))
+
+        # Miscellaneous optional attributes
+        combinations = item_data.get('combine', None)
+        combinations2 = item_data.get('combine2', None)
+        set_attr('stackable', item_data.get('stackable', False))
+        set_attr('combinations', None if combinations is None else MappingProxyType(dict(combinations)))
+        set_attr('combinations2', None if combinations2 is None else tuple(map(tuple, combinations2)))
+        set_attr('_file', file)
+        # The data file's generation (see DataCatalog.generation()) the definition was built from
+        set_attr('_generation', generation)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __copy__(self) -> 'ItemDefinition':
+        return self
+
+    def __deepcopy__(self, memo: Dict) -> 'ItemDefinition':
+        return self
+
+    def __reduce__(self) -> tuple:
+        # Unpickled items share the definition from the data file, like any other
+        return (self.__class__.get, (self.ID, self._file))
+
+    def _repr_items(self):
+        return ((key, value) for key, value in super()._repr_items() if key not in ('_file', '_generation'))
+
+    @classmethod
+    def get(cls, id_num: int, file: str=ITEM_FILE) -> 'ItemDefinition':
+        """
+        Returns the shared definition of an item ID
+
+        The definition is rebuilt if the underlying data file has changed.
+        """
+        key = (int(id_num), file)
+        generation = CATALOG.generation(file)
+        definition = cls._definitions.get(key)
+        if definition is None or definition._generation != generation:
+            item_data = DataFileMixin._get_by_ID(id_num, 'items', file)
+            definition = cls._definitions[key] = cls(id_num, item_data, file, generation)
+        return definition
+
+    @classmethod
+    async def aget(cls, id_num: int, file: str=ITEM_FILE) -> 'ItemDefinition':
+        """ Asynchronous version of get(); doesn't block the event loop when the data file needs loading """
+        key = (int(id_num), file)
+        generation = CATALOG.generation(file)
+        definition = cls._definitions.get(key)
+        if definition is None or definition._generation != generation:
+            item_data = await DataFileMixin._aget_by_ID(id_num, 'items', file)
+            definition = cls._definitions[key] = cls(id_num, item_data, file, generation)
+        return definition
+
+
+class Item(ReprMixin, DataFileMixin, StateMixin):
 
     """ Class for generating item objects; used by Inventory and Player """
 
@@ -21,6 +148,8 @@ class Item(ReprMixin, DataFileMixin):
                  'legs',
                  'off-hand',)
 
+    __slots__ = ('definition', 'metadata', '_count',)
+
     def __init__(self, id_num: int, **kwargs) -> None:
 
         """
@@ -36,44 +165,77 @@ class Item(ReprMixin, DataFileMixin):
         - meta: metadata describing the item, defaults to None
         """
 
-        # Get item data with DataFileMixin.get_item_by_ID()
-        item_data = self.get_item_by_ID(
+        # The static item data is shared between all items of the same ID
+        self.definition = ItemDefinition.get(
             id_num,
             file=kwargs.get('file', ITEM_FILE)
         )
-
-        # Basic attributes every item has defined
-        self.ID = int(id_num)
-        self.name = item_data['name']
-        self.slot = item_data['type']
-        self.descriptions = item_data['examine']
         #NOTE: The item's actual description
         #is defined in the Item.description property!
         #This is due to the distinction between
         #normal and stackable items.
 
-        # Attributes exclusive to wearable items
-        if self.slot in self.EQUIPMENT:
-            self.attack = item_data.get('atk', None)
-            self.defence = item_data.get('def', None)
-            self.specialAttack = item_data.get('specialAttack', None)
-
-        # Miscellaneous optional attributes
-        self.stackable = item_data.get('stackable', False)
-        self.combinations = item_data.get('combine', None)
-        self.combinations2 = item_data.get('combine2', None)
-        #if self.combinations is not None:
-        #    self.combinations = {int(k):int(v) for k,v in self.combinations.items()}
         self.metadata = kwargs.get('meta', None)
         if self.stackable:
             self._count = kwargs.get('count', 1)
 
+    @classmethod
+    def from_definition(cls, definition: ItemDefinition, metadata: Any=None, count: int=1) -> 'Item':
+        """ Creates an item straight from a definition, skipping the data file lookup """
+        item = object.__new__(cls)
+        item.definition = definition
+        item.metadata = metadata
+        if definition.stackable:
+            item._count = count
+        return item
+
+    @classmethod
+    async def acreate(cls, id_num: int, **kwargs) -> 'Item':
+        """
+        Asynchronous version of Item(); accepts the same arguments
+
+        Loading the data file, if needed, doesn't block the event loop.
+        """
+        definition = await ItemDefinition.aget(id_num, file=kwargs.get('file', ITEM_FILE))
+        return cls.from_definition(definition, kwargs.get('meta', None), kwargs.get('count', 1))
+
+    def to_state(self) -> List:
+        """ Returns the item as [ID, stack size (None if not stackable), metadata] """
+        return [self.ID, self._count if self.stackable else None, self.metadata]
+
+    @classmethod
+    def from_state(cls, state: List) -> 'Item':
+        ID, count, metadata = state
+        return cls.from_definition(ItemDefinition.get(ID), metadata, count)
+
+    # Static attributes are read from the shared definition
+    ID = property(lambda self: self.definition.ID)
+    name = property(lambda self: self.definition.name)
+    slot = property(lambda self: self.definition.slot)
+    descriptions = property(lambda self: self.definition.descriptions)
+    stackable = property(lambda self: self.definition.stackable)
+    combinations = property(lambda self: self.definition.combinations)
+    combinations2 = property(lambda self: self.definition.combinations2)
+
+    # Attributes exclusive to wearable items
+    attack = property(lambda self: self.definition.attack)
+    defence = property(lambda self: self.definition.defence)
+    specialAttack = property(lambda self: self.definition.specialAttack)
+
     def __eq__(self, item: object) -> bool:
         """ Compares the ID and metadata values of two items """
         if not isinstance(item, Item):
             return NotImplemented
         return self.ID == item.ID and self.metadata == item.metadata
 
+    def __hash__(self) -> int:
+        """
+        Hashes the ID and metadata values, like __eq__ compares them
+
+        Don't change the metadata of an item used in a set or as a dict key.
+        """
+        return hash(stack_key(self))
+
     def __lt__(self, item: object) -> bool:
         if not isinstance(item, Item):
             return NotImplemented
@@ -94,7 +256,273 @@ class Item(ReprMixin, DataFileMixin):
         return examine
 
 
-class Container(ReprMixin):
+def freeze_metadata(value: Any) -> Any:
+    """
+    Converts item metadata into an equivalent, hashable form
+
+    Containers are tagged with their kind, so that frozen values are equal
+    exactly when the original values are (a list never equals a tuple, nor
+    a dict a set of pairs). Metadata made of anything other than hashable
+    values, dicts, lists, tuples and sets is rejected with a TypeError.
+    """
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return ('dict', frozenset((key, freeze_metadata(val)) for key, val in value.items()))
+    if isinstance(value, list):
+        return ('list', tuple(freeze_metadata(val) for val in value))
+    if isinstance(value, tuple):
+        return ('tuple', tuple(freeze_metadata(val) for val in value))
+    if isinstance(value, (set, frozenset)):
+        # set() == frozenset(), so both share a tag
+        return ('set', frozenset(freeze_metadata(val) for val in value))
+    try:
+        hash(value)
+    except TypeError:
+        raise TypeError(f"Unsupported item metadata type: {type(value).__name__}") from None
+    return value
+
+
+def stack_key(item: Item) -> tuple:
+    """ Returns the key under which items of the same kind are stacked """
+    return (item.ID, freeze_metadata(item.metadata))
+
+
+class Recipe(NamedTuple):
+    """ A single combine2 recipe: the base item and materials it consumes, and the item it makes """
+    base: int
+    combination: int
+    materials: tuple
+    result: int
+
+    @property
+    def requirements(self) -> Dict[int, int]:
+        """ How many of each item ID (including the base item) one craft consumes """
+        requirements: Dict[int, int] = {}
+        for ID in (self.base,) + self.materials:
+            requirements[ID] = requirements.get(ID, 0) + 1
+        return requirements
+
+    def times(self, counts: Dict[int, int]) -> int:
+        """ How many times the recipe can be crafted with the given item counts """
+        return min(counts.get(ID, 0) // amount for ID, amount in self.requirements.items())
+
+
+class RecipeIndex:
+    """
+    Every combine2 recipe of an item data file, indexed by materials
+
+    Use RecipeIndex.get() to share one index per data file; it is rebuilt
+    whenever the data file is reloaded.
+    """
+
+    # file -> RecipeIndex
+    _indexes: Dict[str, 'RecipeIndex'] = {}
+
+    def __init__(self, items: Dict) -> None:
+        """ Builds the index from the 'items' section of a data file """
+        self._source = items
+        self.recipes: List[Recipe] = []
+        # Sorted (ID, amount) pairs of everything a craft consumes -> recipes
+        self.by_materials: Dict[tuple, List[Recipe]] = {}
+        # Item ID -> recipes consuming it
+        self.by_ingredient: Dict[int, List[Recipe]] = {}
+        for ID, item_data in items.items():
+            for combination, recipe_data in enumerate(item_data.get('combine2', None) or ()):
+                recipe = Recipe(int(ID), combination, tuple(map(int, recipe_data[:-1])), int(recipe_data[-1]))
+                self.recipes.append(recipe)
+                requirements = recipe.requirements
+                self.by_materials.setdefault(tuple(sorted(requirements.items())), []).append(recipe)
+                for ingredient in requirements:
+                    self.by_ingredient.setdefault(ingredient, []).append(recipe)
+
+    @classmethod
+    def get(cls, file: str=ITEM_FILE) -> 'RecipeIndex':
+        """ Returns the shared recipe index of an item data file """
+        items = CATALOG.load(file)['items']
+        index = cls._indexes.get(file)
+        if index is None or index._source is not items:
+            index = cls._indexes[file] = cls(items)
+        return index
+
+    def lookup(self, materials: Iterable[int]) -> List[Recipe]:
+        """ Returns the recipes consuming exactly the given item IDs (base item included) """
+        requirements: Dict[int, int] = {}
+        for ID in materials:
+            requirements[ID] = requirements.get(ID, 0) + 1
+        return list(self.by_materials.get(tuple(sorted(requirements.items())), ()))
+
+    def candidates(self, counts: Dict[int, int]) -> List[Recipe]:
+        """ Returns the recipes using at least one of the given item IDs """
+        seen = {}
+        for ID in counts:
+            for recipe in self.by_ingredient.get(ID, ()):
+                seen[recipe] = None
+        return list(seen)
+
+
+class _NoLock:
+    """ Stands in for a lock in containers that aren't shared between threads """
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def __reduce__(self) -> str:
+        # Unpickled containers get the shared instance back
+        return 'NO_LOCK'
+
+
+NO_LOCK = _NoLock()
+
+
+def synchronized(method: Callable) -> Callable:
+    """ Runs a Container method while holding the container's lock """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def locked(*containers: 'Container'):
+    """
+    Holds the locks of several containers at once
+
+    The locks are always taken in the same (id) order, so threads locking
+    overlapping sets of containers can't deadlock.
+    """
+    with ExitStack() as stack:
+        for container in sorted(set(containers), key=id):
+            stack.enter_context(container._lock)
+        yield
+
+
+class ItemMultiset(Counter):
+    """
+    Counts items by ID and metadata, like stacks in a container
+
+    Stackable items are counted by their stack sizes. Arithmetic between
+    multisets returns a multiset, so comparing two inventories or checking
+    for required items are dictionary operations.
+    """
+
+    @classmethod
+    def from_items(cls, items: Iterable[Item]) -> 'ItemMultiset':
+        multiset = cls()
+        for item in items:
+            multiset[item] += item._count if item.stackable else 1
+        return multiset
+
+    def issubset(self, other: 'ItemMultiset') -> bool:
+        """ Tells if the other multiset has at least as many of every item """
+        return all(other[item] >= count for item, count in self.items() if count > 0)
+
+    def to_items(self) -> List[Item]:
+        """ Returns the counted items, as stacks where possible """
+        items = []
+        for item, count in self.items():
+            if count <= 0:
+                continue
+            if item.stackable:
+                items.append(Item.from_definition(item.definition, item.metadata, count))
+            else:
+                items.extend(Item.from_definition(item.definition, item.metadata) for _ in range(count))
+        return items
+
+    def __add__(self, other: Counter) -> 'ItemMultiset':
+        return type(self)(super().__add__(other))
+
+    def __sub__(self, other: Counter) -> 'ItemMultiset':
+        return type(self)(super().__sub__(other))
+
+    def __or__(self, other: Counter) -> 'ItemMultiset':
+        return type(self)(super().__or__(other))
+
+    def __and__(self, other: Counter) -> 'ItemMultiset':
+        return type(self)(super().__and__(other))
+
+
+class TransactionResult(NamedTuple):
+    """ Outcome of a bulk Container operation """
+    success: bool
+    message: str
+    items: List
+
+
+class Change(NamedTuple):
+    """
+    A single entry of a container's change journal
+
+    kind is one of:
+    - 'add': slot was added, value is the item's state
+    - 'remove': slot was removed, value is None
+    - 'count': the stack size in slot changed, value is the new size
+    - 'gear': the gear slot named by slot changed, value is the worn item's state or None
+    - 'clear': every slot was removed, slot and value are None
+    """
+    seq: int
+    kind: str
+    slot: Any
+    value: Any
+
+
+class ChangeJournal:
+    """
+    Append-only, bounded log of the changes made to a container
+
+    Every change gets the next sequence number. Slot IDs are never reused
+    and new slots always go last, so replaying the changes in order on a
+    copy of the container reproduces its contents and slot order.
+    """
+
+    __slots__ = ('seq', 'floor', 'limit', '_changes',)
+
+    def __init__(self, limit: int=JOURNAL_LIMIT) -> None:
+        self.seq = 0
+        # Changes up to and including floor have been dropped
+        self.floor = 0
+        self.limit = limit
+        self._changes = deque()
+
+    def __len__(self) -> int:
+        return len(self._changes)
+
+    def record(self, kind: str, slot: Any=None, value: Any=None) -> None:
+        self.seq += 1
+        self._changes.append(Change(self.seq, kind, slot, value))
+        if len(self._changes) > self.limit:
+            self.floor = self._changes.popleft().seq
+
+    def since(self, seq: int) -> Union[List[Change], None]:
+        """
+        Returns the changes made after sequence number seq
+
+        Returns None if some of them have already been dropped, in which
+        case the caller has to start over from the container's full state.
+        """
+        if seq < self.floor:
+            return None
+        if seq >= self.seq:
+            return []
+        # Sequence numbers are contiguous, so the position can be computed
+        return list(islice(self._changes, seq - self.floor, None))
+
+    def compact(self, through: int=None) -> int:
+        """ Drops the changes up to sequence number through (default: all of them); returns how many """
+        through = self.seq if through is None else min(through, self.seq)
+        dropped = 0
+        while self._changes and self._changes[0].seq <= through:
+            self._changes.popleft()
+            dropped += 1
+        self.floor = max(self.floor, through)
+        return dropped
+
+
+class Container(ReprMixin, StateMixin):
     """ Class used to create item storages """
     def __init__(self, items: List=None, max_capacity: int=32, **kwargs) -> None:
         """ Initialises Container with default values """
@@ -102,80 +530,949 @@ class Container(ReprMixin):
 
         self.name = kwargs.get('container_name', 'container')
 
+        # Containers shared between threads need thread_safe=True
+        self._lock = RLock() if kwargs.get('thread_safe', False) else NO_LOCK
+
         if items is None:
-            self.items: List = []
-        elif len(items) <= self.max_capacity:
-            self.items = items
-        else:
+            items = []
+        elif len(items) > self.max_capacity:
             raise ValueError(f"Cannot initialise container with over {self.max_capacity} items")
 
+        # dirty is set whenever the container changes; persistence layers
+        # clear it with mark_clean() once they have saved the container.
+        # Only changes made through the container are noticed: writing an
+        # item's _count directly goes untracked, so use set_count() instead
+        self.dirty = True
+        self._state_cache = None
+        # Slot IDs are never reused, so journal entries stay unambiguous
+        self._next_slot = 0
+        # Set when the slot storage is shared with a clone
+        self._shared = False
+        # Called with (item ID, whether it is held) as item IDs come and go; see _watch()
+        self._listener = None
+        # item ID -> number of slots holding it, counted only while there's a listener
+        self._held: Dict[int, int] = {}
+        # A journal_limit of 0 or None turns the journal off
+        limit = kwargs.get('journal_limit', JOURNAL_LIMIT)
+        self._journal = ChangeJournal(limit) if limit else None
+        self._init_storage()
+        self.items = items
+
+    @property
+    @synchronized
+    def items(self) -> List:
+        """
+        The container's items in slot order
+
+        Every access returns a new list, so changing the list doesn't change
+        the container; assign a new list to this property to replace the
+        container's contents.
+        """
+        return list(self._item_list())
+
+    @items.setter
+    @synchronized
+    def items(self, items: List) -> None:
+        # Views may point into this container, so copy them before it is cleared
+        items = [self._standalone(item) for item in items]
+        self._clear_slots()
+        for item in items:
+            self._add_slot(item)
+
+    def _item_list(self) -> List:
+        """ Returns the items in slot order; the list is reused until the next change, so don't modify it """
+        if self._items_cache is None:
+            self._items_cache = self._snapshot()
+        return self._items_cache
+
+    @staticmethod
+    def _standalone(item: Item) -> Item:
+        """ Returns the item, or a copy of it if it is an ItemView, which mustn't outlive its container's slot """
+        return item.detach() if isinstance(item, ItemView) else item
+
+    # Storage primitives; subclasses with a different slot storage override these
+
+    def _init_storage(self) -> None:
+        """ Sets up an empty slot storage """
+        # Slots are stored in an insertion-ordered dictionary so that any slot
+        # can be removed in constant time, while _index maps each stack key
+        # to the slots holding items of that kind (in slot order)
+        self._slots: Dict[int, Item] = {}
+        self._index: Dict[tuple, Dict[int, None]] = {}
+        self._items_cache = None
+
+    def _copy_storage(self) -> None:
+        """ Replaces the slot storage with a copy that can be modified without affecting clones """
+        self._slots = {slot: Item.from_definition(item.definition, item.metadata, item._count)
+                       if item.stackable else item
+                       for slot, item in self._slots.items()}
+        self._index = {key: dict(slots) for key, slots in self._index.items()}
+
+    def _own(self) -> None:
+        """ Copies the slot storage if it is shared with a clone; called before every modification """
+        if self._shared:
+            self._shared = False
+            self._copy_storage()
+
+    def _touch(self, slots_changed: bool=True) -> None:
+        """ Marks the container as modified """
+        if slots_changed:
+            self._items_cache = None
+        self._state_cache = None
+        self.dirty = True
+
+    def _snapshot(self) -> List:
+        """ Returns the stored items in slot order """
+        return list(self._slots.values())
+
+    def _held_items(self) -> Iterable[Item]:
+        """ Returns every item counted as held by the container """
+        return self._snapshot()
+
+    def _track(self, ID: int, delta: int) -> None:
+        """ Counts the slots holding an item ID, telling the listener when the ID appears or disappears """
+        count = self._held.get(ID, 0) + delta
+        if count > 0:
+            self._held[ID] = count
+            if count == delta:
+                self._listener(ID, True)
+        else:
+            del self._held[ID]
+            self._listener(ID, False)
+
+    def __getstate__(self) -> Dict:
+        # The listener belongs to a registry, which doesn't travel with the
+        # container; locks can't be pickled, so only whether there was one is kept
+        state = self.__dict__.copy()
+        state['_listener'] = None
+        state['_held'] = {}
+        state['_lock'] = self._lock is not NO_LOCK
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._lock = RLock() if state['_lock'] else NO_LOCK
+
+    @synchronized
+    def _watch(self, listener: Union[Callable, None]) -> None:
+        """
+        Sets the function told about item IDs appearing and disappearing, or removes it with None
+
+        The listener is called right away for every item ID already held.
+        """
+        self._listener = None
+        self._held = {}
+        if listener is not None:
+            self._listener = listener
+            for item in self._held_items():
+                self._track(item.ID, 1)
+
+    def _clear_slots(self) -> None:
+        """ Empties the slot storage """
+        if self._listener is not None:
+            for item in self._snapshot():
+                self._track(item.ID, -1)
+        # A fresh storage is never shared
+        self._shared = False
+        self._init_storage()
+        if self._journal is not None:
+            self._journal.record('clear')
+        self._touch()
+
+    def _add_slot(self, item: Item) -> None:
+        """ Stores an item in a new slot """
+        self._own()
+        item = self._standalone(item)
+        slot = self._next_slot
+        self._next_slot += 1
+        self._slots[slot] = item
+        self._index.setdefault(stack_key(item), {})[slot] = None
+        if self._journal is not None:
+            self._journal.record('add', slot, item.to_state())
+        if self._listener is not None:
+            self._track(item.ID, 1)
+        self._touch()
+
+    def _remove_slot(self, slot: int) -> Item:
+        """ Removes and returns the item in the given slot """
+        self._own()
+        item = self._slots.pop(slot)
+        key = stack_key(item)
+        slots = self._index[key]
+        del slots[slot]
+        if not slots:
+            del self._index[key]
+        if self._journal is not None:
+            self._journal.record('remove', slot)
+        if self._listener is not None:
+            self._track(item.ID, -1)
+        self._touch()
+        return item
+
+    def _slot_item(self, slot: int) -> Item:
+        """ Returns the item in the given slot """
+        return self._slots[slot]
+
+    def _slot_count(self, slot: int) -> int:
+        """ Returns the stack size of the stackable item in the given slot """
+        return self._slots[slot]._count
+
+    def _add_count(self, slot: int, amount: int) -> int:
+        """ Grows (or shrinks) the stack in the given slot, returning its new size """
+        self._own()
+        item = self._slots[slot]
+        item._count += amount
+        if self._journal is not None:
+            self._journal.record('count', slot, item._count)
+        self._touch(slots_changed=False)
+        return item._count
+
+    def _find_slot(self, item: Item) -> Union[int, None]:
+        """ Returns the first slot holding an item equal to the given one """
+        slots = self._index.get(stack_key(item))
+        if not slots:
+            return None
+        return next(iter(slots))
+
+    def _repr_items(self):
+        for key, value in super()._repr_items():
+            if not key.startswith('_'):
+                yield key, value
+        yield 'items', self.items
+
     def __len__(self) -> int:
-        return len(self.items)
+        return len(self._slots)
+
+    def _build_state(self) -> Dict:
+        return {
+            'name': self.name,
+            'max_capacity': self.max_capacity,
+            'items': [item.to_state() for item in self._item_list()],
+        }
+
+    @synchronized
+    def to_state(self) -> Dict:
+        """
+        Returns the container's contents as plain data
+
+        The state is cached until the container changes, so treat it as
+        read-only. Stack sizes changed without set_count() aren't noticed.
+        """
+        if self._state_cache is None:
+            self._state_cache = self._build_state()
+        return self._state_cache
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'Container':
+        container = cls(items=[Item.from_state(item) for item in state['items']],
+                        max_capacity=state['max_capacity'],
+                        container_name=state['name'])
+        container.mark_clean()
+        return container
+
+    def mark_clean(self) -> None:
+        """ Clears the dirty flag, eg. after the container has been saved """
+        self.dirty = False
+
+    @synchronized
+    def clone(self) -> 'Container':
+        """
+        Returns an equal container, sharing the slot storage until either is modified
+
+        Cloning takes constant time, so it suits mass-producing identical
+        containers. The clone starts with an empty journal. Items read from
+        the containers are shared until then too, so only modify them
+        through the containers.
+        """
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        clone._lock = NO_LOCK if self._lock is NO_LOCK else RLock()
+        clone._journal = None if self._journal is None else ChangeJournal(self._journal.limit)
+        clone._items_cache = None
+        clone._listener = None
+        clone._held = {}
+        clone.dirty = True
+        self._shared = clone._shared = True
+        return clone
+
+    @property
+    def sequence(self) -> int:
+        """ Sequence number of the latest change; pair it with to_state() to sync from later on """
+        return 0 if self._journal is None else self._journal.seq
+
+    @synchronized
+    def changes_since(self, seq: int) -> Union[List[Change], None]:
+        """
+        Returns the changes made after sequence number seq, oldest first
+
+        Returns None if the journal no longer reaches back that far, or is
+        turned off; the caller then has to resync from to_state() and sequence.
+        """
+        return None if self._journal is None else self._journal.since(seq)
+
+    @synchronized
+    def compact_journal(self, through: int=None) -> int:
+        """ Forgets the changes up to sequence number through, eg. once every client has them """
+        return 0 if self._journal is None else self._journal.compact(through)
+
+    def _detached_items(self) -> List[Item]:
+        """ Returns the stored items in slot order, as objects that survive clearing the storage """
+        return list(self._slots.values())
+
+    def _consolidated(self) -> List[Item]:
+        """ Returns the items in slot order, with every stackable item merged into its first stack """
+        # stack key -> position of the first stack in items
+        stacks: Dict[tuple, int] = {}
+        items = []
+        for item in self._detached_items():
+            if item.stackable:
+                key = stack_key(item)
+                position = stacks.get(key)
+                if position is not None:
+                    # Merged into a new Item, as the stored one may be shared with a clone
+                    first = items[position]
+                    items[position] = Item.from_definition(first.definition, first.metadata,
+                                                           first._count + item._count)
+                    continue
+                stacks[key] = len(items)
+            items.append(item)
+        return items
+
+    @synchronized
+    def compact(self) -> int:
+        """
+        Merges fragmented stacks of the same item into the first of them
 
+        The order of the remaining slots is kept. Returns the number of freed slots.
+        """
+        items = self._consolidated()
+        freed = len(self) - len(items)
+        if freed:
+            self.items = items
+        return freed
+
+    @synchronized
+    def sort(self, key: Callable=None, reverse: bool=False, consolidate: bool=True) -> bool:
+        """
+        Sorts the slots, by default by item ID, consolidating fragmented stacks first
+
+        The sort is stable: items with equal keys keep their relative order,
+        so sorting an already sorted container changes nothing. Returns
+        whether any slot changed.
+        """
+        if consolidate:
+            items = self._consolidated()
+        else:
+            items = self._detached_items()
+        ordered = sorted(items, key=key or (lambda item: item.ID), reverse=reverse)
+        if len(ordered) == len(self) and all(a is b for a, b in zip(ordered, items)):
+            return False
+        self.items = ordered
+        return True
+
+    @synchronized
+    def to_multiset(self) -> ItemMultiset:
+        """ Returns the container's contents as an ItemMultiset """
+        return ItemMultiset.from_items(self._item_list())
+
+    @synchronized
+    def __contains__(self, item: object) -> bool:
+        if not isinstance(item, Item):
+            return False
+        return stack_key(item) in self._index
+
+    @synchronized
     def append(self, item: Item) -> str:
-        add_new = True
         if item.stackable:
-            inv_item = next((i for i in self.items if i == item), None)
-            if inv_item is not None:
-                add_new = False
-                inv_item._count += item._count
-                return f"{inv_item._count} {item.name} in container"
+            slot = self._find_slot(item)
+            if slot is not None:
+                count = self._add_count(slot, item._count)
+                return f"{count} {item.name} in container"
 
-        if add_new:
-            if len(self) < self.max_capacity:
-                self.items.append(item)
-                return f"{item.name} added to inventory"
+        if len(self) < self.max_capacity:
+            self._add_slot(item)
+            return f"{item.name} added to inventory"
 
         return "No room in inventory"
 
+    @synchronized
+    def set_count(self, item: Item, count: int) -> None:
+        """ Sets the size of the first stack equal to the given item, keeping track of the change """
+        if not item.stackable:
+            raise ValueError(f"{item.name} is not stackable")
+        slot = self._find_slot(item)
+        if slot is None:
+            raise KeyError(f"No {item.name} in the {self.name}")
+        self._add_count(slot, count - self._slot_count(slot))
+
+    @synchronized
     def remove(self, item: Item, count: int=1) -> str:
-        try:
-            if item.stackable:
-                inv_item = self.items[self.items.index(item)]
-                if inv_item._count < count:
-                    return "You don't have that many"
-                elif inv_item._count > count:
-                    inv_item._count -= count
-                    return f"{count}/{inv_item._count+count} {item.name} removed"
-                else:
-                    self.items.remove(item)
-            else:
-                self.items.remove(item)
-            return f"{item.name} was successfully removed"
-        except ValueError:
+        slot = self._find_slot(item)
+        if slot is None:
             return f"{'You don' if self.name=='inventory' else 'The {} doesn'.format(self.name)}'t have any {item.name}s"
 
+        if item.stackable:
+            stack_size = self._slot_count(slot)
+            if stack_size < count:
+                return "You don't have that many"
+            elif stack_size > count:
+                self._add_count(slot, -count)
+                return f"{count}/{stack_size} {item.name} removed"
+        self._remove_slot(slot)
+        return f"{item.name} was successfully removed"
+
+    @staticmethod
+    def _invalid_stack(items: List[Item]) -> Union[Item, None]:
+        """ Returns the first stackable item whose stack size isn't positive, or None """
+        for item in items:
+            if item.stackable and item._count <= 0:
+                return item
+        return None
+
+    def _plan_add(self, items: Iterable[Item]) -> tuple:
+        """
+        Works out how a batch of items would be stored without modifying the container
+
+        Returns a dictionary of extra counts for existing stacks, keyed by
+        stack key, and a list of [item, count] pairs needing new slots.
+        """
+        merges: Dict[tuple, int] = {}
+        new_stacks: Dict[tuple, List] = {}
+        new_slots: List[List] = []
+        for item in items:
+            if not item.stackable:
+                new_slots.append([item, None])
+                continue
+            key = stack_key(item)
+            if key in self._index:
+                merges[key] = merges.get(key, 0) + item._count
+            elif key in new_stacks:
+                new_stacks[key][1] += item._count
+            else:
+                new_stacks[key] = entry = [item, item._count]
+                new_slots.append(entry)
+        return merges, new_slots
+
+    def _plan_remove(self, items: Iterable[Item]) -> tuple:
+        """
+        Works out which slots a batch removal would take from, without modifying the container
+
+        Returns a dictionary of amounts to remove keyed by stack key (stackable
+        items count their stack sizes, other items count as one each), and the
+        first item that cannot be removed, or None if every item can be.
+        """
+        required: Dict[tuple, int] = {}
+        samples: Dict[tuple, Item] = {}
+        for item in items:
+            key = stack_key(item)
+            required[key] = required.get(key, 0) + (item._count if item.stackable else 1)
+            samples.setdefault(key, item)
+
+        for key, amount in required.items():
+            slots = self._index.get(key, ())
+            if samples[key].stackable:
+                available = sum(self._slot_count(slot) for slot in slots)
+            else:
+                available = len(slots)
+            if available < amount:
+                return required, samples[key]
+        return required, None
+
+    def _slots_freed(self, required: Dict) -> int:
+        """ Returns how many slots removing the output of _plan_remove() would free """
+        freed = 0
+        for key, amount in required.items():
+            slots = self._index[key]
+            if not self._slot_item(next(iter(slots))).stackable:
+                freed += amount
+                continue
+            for slot in slots:
+                stack_size = self._slot_count(slot)
+                if stack_size > amount:
+                    break
+                amount -= stack_size
+                freed += 1
+                if not amount:
+                    break
+        return freed
+
+    def _apply_add(self, merges: Dict, new_slots: List) -> None:
+        for key, extra in merges.items():
+            self._add_count(next(iter(self._index[key])), extra)
+        for item, count in new_slots:
+            if count is not None:
+                # A new Item, so the caller's item (or the result handed back) isn't the stored stack
+                item = Item.from_definition(item.definition, item.metadata, count)
+            self._add_slot(item)
+
+    def _apply_remove(self, required: Dict) -> List:
+        removed = []
+        for key, amount in required.items():
+            slots = list(self._index[key])
+            first = self._slot_item(slots[0])
+            if not first.stackable:
+                removed.extend(self._remove_slot(slot) for slot in slots[:amount])
+                continue
+            removed.append(Item.from_definition(first.definition, first.metadata, amount))
+            for slot in slots:
+                stack_size = self._slot_count(slot)
+                if stack_size > amount:
+                    self._add_count(slot, -amount)
+                    break
+                amount -= stack_size
+                self._remove_slot(slot)
+                if not amount:
+                    break
+        return removed
+
+    @synchronized
+    def add_many(self, items: Iterable[Item]) -> TransactionResult:
+        """
+        Adds a batch of items in one pass
+
+        Stackable items are merged with existing stacks and with each other.
+        Nothing is added unless the whole batch fits in the container and
+        every stack size is positive.
+        """
+        items = list(items)
+        invalid = self._invalid_stack(items)
+        if invalid is not None:
+            return TransactionResult(False, f"Cannot add {invalid._count} {invalid.name}", [])
+        merges, new_slots = self._plan_add(items)
+        if len(self) + len(new_slots) > self.max_capacity:
+            return TransactionResult(False, f"No room in {self.name}", [])
+        self._apply_add(merges, new_slots)
+        return TransactionResult(True, f"{len(items)} items added to {self.name}", items)
+
+    @synchronized
+    def add_counts(self, counts: Iterable[Tuple[int, int]], file: str=ITEM_FILE) -> TransactionResult:
+        """
+        Adds (item ID, count) pairs without metadata in one pass, eg. rolled loot
+
+        Counts for existing stacks are added to them directly; Items are only
+        created for the slots that need them. Like add_many(), nothing is
+        added unless everything fits. The result holds the newly stored items.
+        """
+        merges: Dict[tuple, int] = {}
+        new_stacks: Dict[tuple, List] = {}
+        new_slots: List[List] = []
+        for ID, count in counts:
+            if count <= 0:
+                continue
+            definition = ItemDefinition.get(ID, file)
+            if not definition.stackable:
+                new_slots.extend([definition, None] for _ in range(count))
+                continue
+            key = (definition.ID, None)
+            if key in self._index:
+                merges[key] = merges.get(key, 0) + count
+            elif key in new_stacks:
+                new_stacks[key][1] += count
+            else:
+                new_stacks[key] = entry = [definition, count]
+                new_slots.append(entry)
+        if len(self) + len(new_slots) > self.max_capacity:
+            return TransactionResult(False, f"No room in {self.name}", [])
+        new_slots = [[Item.from_definition(definition, None, count or 1), count] for definition, count in new_slots]
+        self._apply_add(merges, new_slots)
+        return TransactionResult(True, f"{len(new_slots)} slots filled in {self.name}",
+                                 [item for item, _ in new_slots])
+
+    @synchronized
+    def remove_many(self, items: Iterable[Item]) -> TransactionResult:
+        """
+        Removes a batch of items in one pass
+
+        The stack size of a stackable item is the amount removed. Nothing is
+        removed unless the container holds everything in the batch. The result
+        holds the removed items, with one item per removed stack kind.
+        """
+        items = list(items)
+        invalid = self._invalid_stack(items)
+        if invalid is not None:
+            return TransactionResult(False, f"Cannot remove {invalid._count} {invalid.name}", [])
+        required, missing = self._plan_remove(items)
+        if missing is not None:
+            return TransactionResult(False, f"The {self.name} doesn't have enough {missing.name}s", [])
+        removed = self._apply_remove(required)
+        return TransactionResult(True, f"{len(removed)} items removed from {self.name}", removed)
+
+    @staticmethod
+    def transfer(src: 'Container', dst: 'Container', items: Iterable[Item]) -> TransactionResult:
+        """
+        Atomically moves a batch of items from one container to another
+
+        Both sides are validated before either is modified, so a failed
+        transfer leaves the containers untouched.
+        """
+        items = list(items)
+        if src is dst:
+            return TransactionResult(True, "Nothing to transfer", [])
+        with locked(src, dst):
+            return Container._transfer(src, dst, items)
+
+    @staticmethod
+    def _transfer(src: 'Container', dst: 'Container', items: List[Item]) -> TransactionResult:
+        invalid = Container._invalid_stack(items)
+        if invalid is not None:
+            return TransactionResult(False, f"Cannot transfer {invalid._count} {invalid.name}", [])
+        required, missing = src._plan_remove(items)
+        if missing is not None:
+            return TransactionResult(False, f"The {src.name} doesn't have enough {missing.name}s", [])
+
+        merges, new_slots = dst._plan_add(items)
+        if len(dst) + len(new_slots) > dst.max_capacity:
+            return TransactionResult(False, f"No room in {dst.name}", [])
+
+        removed = src._apply_remove(required)
+        merges, new_slots = dst._plan_add(removed)
+        dst._apply_add(merges, new_slots)
+        return TransactionResult(True, f"{len(removed)} items moved from {src.name} to {dst.name}", removed)
+
+
+class ItemView(Item):
+    """
+    An Item read from a CompactContainer
+
+    The stack size is read from, and written to, the container's arrays. A view
+    stays valid until the container is next modified; containers store a
+    detached copy of any view added to them.
+    """
+
+    __slots__ = ('_container', '_slot',)
+
+    def _repr_items(self):
+        return ((key, value) for key, value in super()._repr_items()
+                if key not in self.__slots__)
+
+    @property
+    def _count(self) -> int:
+        if not self.stackable:
+            raise AttributeError(f"{self.name} is not stackable")
+        return self._container._counts[self._slot]
+
+    @_count.setter
+    def _count(self, value: int) -> None:
+        self._container._add_count(self._slot, value - self._container._counts[self._slot])
+
+    def detach(self) -> Item:
+        """ Returns a standalone Item equal to the view """
+        return Item.from_definition(self.definition, self.metadata,
+                                    self._container._counts[self._slot])
+
+    def __reduce__(self) -> tuple:
+        # Pickled as a standalone Item
+        return (Item.from_definition, (self.definition, self.metadata, self._container._counts[self._slot]))
+
+
+class CompactContainer(Container):
+    """
+    A Container storing its slots in parallel typed arrays
+
+    Every slot takes a few bytes in three arrays (definition handle, stack size
+    and metadata handle) instead of a whole Item object. Items are only
+    created, as ItemViews, when the container's contents are read. Meant for
+    banks and other large storages.
+    """
+
+    # Removed slots are compacted away once they make up this share of the arrays
+    COMPACT_RATIO = 0.5
+
+    def _init_storage(self) -> None:
+        # _defs holds a handle to _definitions for every slot; removed slots
+        # are marked with -1 until the arrays are compacted
+        self._defs = array('i')
+        self._counts = array('q')
+        self._metas = array('i')
+        # Journal slot ID of every slot
+        self._ids = array('q')
+        self._definitions: List[ItemDefinition] = []
+        self._definition_handles: Dict[ItemDefinition, int] = {}
+        self._metadata: List = [None]
+        self._metadata_handles: Dict[Any, int] = {None: 0}
+        self._index: Dict[tuple, array] = {}
+        self._size = 0
+        self._items_cache = None
+
+    def _snapshot(self) -> List:
+        return [self._slot_item(slot) for slot in range(len(self._defs)) if self._defs[slot] >= 0]
+
+    def _intern(self, item: Item) -> tuple:
+        """ Returns the definition and metadata handles of an item """
+        definition = item.definition
+        def_handle = self._definition_handles.get(definition)
+        if def_handle is None:
+            def_handle = self._definition_handles[definition] = len(self._definitions)
+            self._definitions.append(definition)
+        frozen = freeze_metadata(item.metadata)
+        meta_handle = self._metadata_handles.get(frozen)
+        if meta_handle is None:
+            meta_handle = self._metadata_handles[frozen] = len(self._metadata)
+            self._metadata.append(item.metadata)
+        return def_handle, meta_handle
+
+    def _copy_storage(self) -> None:
+        self._defs = array('i', self._defs)
+        self._counts = array('q', self._counts)
+        self._metas = array('i', self._metas)
+        self._ids = array('q', self._ids)
+        self._definitions = list(self._definitions)
+        self._definition_handles = dict(self._definition_handles)
+        self._metadata = list(self._metadata)
+        self._metadata_handles = dict(self._metadata_handles)
+        self._index = {key: array('i', slots) for key, slots in self._index.items()}
+
+    def _add_slot(self, item: Item) -> None:
+        self._own()
+        self._compact_arrays()
+        def_handle, meta_handle = self._intern(item)
+        key = stack_key(item)
+        # Converted up front: a stack size that doesn't fit must fail before
+        # any of the parallel arrays grows, or they would fall out of step
+        count = array('q', (item._count if item.stackable else 1,))
+        slot = len(self._defs)
+        self._defs.append(def_handle)
+        self._counts.extend(count)
+        self._metas.append(meta_handle)
+        self._ids.append(self._next_slot)
+        self._index.setdefault(key, array('i')).append(slot)
+        self._size += 1
+        if self._journal is not None:
+            self._journal.record('add', self._next_slot, item.to_state())
+        self._next_slot += 1
+        if self._listener is not None:
+            self._track(item.ID, 1)
+        self._touch()
+
+    def _remove_slot(self, slot: int) -> Item:
+        self._own()
+        item = self._detached_item(slot)
+        key = stack_key(item)
+        slots = self._index[key]
+        slots.remove(slot)
+        if not slots:
+            del self._index[key]
+        self._defs[slot] = -1
+        self._size -= 1
+        if self._journal is not None:
+            self._journal.record('remove', self._ids[slot])
+        if self._listener is not None:
+            self._track(item.ID, -1)
+        self._touch()
+        return item
+
+    def _compact_arrays(self) -> None:
+        """
+        Drops removed slots from the arrays and rebuilds the index
+
+        Only called between operations, as compacting renumbers the slots.
+        """
+        if len(self._defs) - self._size <= len(self._defs) * self.COMPACT_RATIO:
+            return
+        live = [slot for slot in range(len(self._defs)) if self._defs[slot] >= 0]
+        self._defs = array('i', (self._defs[slot] for slot in live))
+        self._counts = array('q', (self._counts[slot] for slot in live))
+        self._metas = array('i', (self._metas[slot] for slot in live))
+        self._ids = array('q', (self._ids[slot] for slot in live))
+        self._index = {}
+        for slot in range(len(live)):
+            key = (self._definitions[self._defs[slot]].ID,
+                   freeze_metadata(self._metadata[self._metas[slot]]))
+            self._index.setdefault(key, array('i')).append(slot)
+
+    def _detached_item(self, slot: int) -> Item:
+        """ Returns a standalone Item equal to the one in the given slot """
+        return Item.from_definition(self._definitions[self._defs[slot]],
+                                    self._metadata[self._metas[slot]],
+                                    self._counts[slot])
+
+    def _detached_items(self) -> List[Item]:
+        return [self._detached_item(slot) for slot in range(len(self._defs)) if self._defs[slot] >= 0]
+
+    def _slot_item(self, slot: int) -> Item:
+        view = object.__new__(ItemView)
+        view.definition = self._definitions[self._defs[slot]]
+        view.metadata = self._metadata[self._metas[slot]]
+        view._container = self
+        view._slot = slot
+        return view
+
+    def _slot_count(self, slot: int) -> int:
+        return self._counts[slot]
+
+    def _add_count(self, slot: int, amount: int) -> int:
+        self._own()
+        self._counts[slot] += amount
+        if self._journal is not None:
+            self._journal.record('count', self._ids[slot], self._counts[slot])
+        self._touch(slots_changed=False)
+        return self._counts[slot]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _build_state(self) -> Dict:
+        # Read straight from the arrays instead of creating views
+        definitions, metadata, counts = self._definitions, self._metadata, self._counts
+        items = []
+        for slot, def_handle in enumerate(self._defs):
+            if def_handle >= 0:
+                definition = definitions[def_handle]
+                items.append([definition.ID,
+                              counts[slot] if definition.stackable else None,
+                              metadata[self._metas[slot]]])
+        return {'name': self.name, 'max_capacity': self.max_capacity, 'items': items}
+
+    @synchronized
+    def remove(self, item: Item, count: int=1) -> str:
+        result = super().remove(item, count)
+        self._compact_arrays()
+        return result
+
+    @synchronized
+    def remove_many(self, items: Iterable[Item]) -> TransactionResult:
+        result = super().remove_many(items)
+        self._compact_arrays()
+        return result
+
+
+class GearLayout(ReprMixin):
+    """
+    Immutable, shared layout of gear slots
+
+    Only one layout exists per sequence of slot names; use GearLayout.get().
+    """
+
+    __slots__ = ('slots', 'positions',)
+
+    # slot names -> GearLayout
+    _layouts: Dict[tuple, 'GearLayout'] = {}
+
+    def __init__(self, slots: tuple) -> None:
+        set_attr = super().__setattr__
+        set_attr('slots', tuple(slots))
+        set_attr('positions', MappingProxyType({slot: i for i, slot in enumerate(self.slots)}))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __copy__(self) -> 'GearLayout':
+        return self
+
+    def __deepcopy__(self, memo: Dict) -> 'GearLayout':
+        return self
+
+    def __reduce__(self) -> tuple:
+        return (self.__class__.get, (self.slots,))
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @classmethod
+    def get(cls, slots: Iterable[str]) -> 'GearLayout':
+        """ Returns the shared layout with the given slot names, eg. the keys of a gear dictionary """
+        slots = tuple(slots)
+        layout = cls._layouts.get(slots)
+        if layout is None:
+            layout = cls._layouts[slots] = cls(slots)
+        return layout
+
+
+class Gear(Mapping):
+    """
+    The worn items of an inventory, in the fixed-size slots of a GearLayout
+
+    Behaves like a read-only dictionary of slot names to items (or None).
+    Items are put on and taken off through the owning Inventory, which keeps
+    its stat totals up to date.
+    """
+
+    __slots__ = ('layout', '_items',)
+
+    def __init__(self, layout: GearLayout, gear: Dict=None) -> None:
+        self.layout = layout
+        if gear is None:
+            self._items = [None] * len(layout)
+        else:
+            self._items = [gear[slot] for slot in layout.slots]
+
+    def __getitem__(self, slot: str) -> Union[Item, None]:
+        return self._items[self.layout.positions[slot]]
+
+    def _put(self, slot: str, item: Union[Item, None]) -> None:
+        """ Fills or empties a slot; only Inventory._set_gear() should call this """
+        self._items[self.layout.positions[slot]] = item
+
+    def __iter__(self):
+        return iter(self.layout.slots)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    # Faster than the generic views of Mapping
+    def items(self) -> List[tuple]:
+        return list(zip(self.layout.slots, self._items))
+
+    def values(self) -> List:
+        return list(self._items)
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
+    def copy(self) -> 'Gear':
+        gear = object.__new__(Gear)
+        gear.layout = self.layout
+        gear._items = list(self._items)
+        return gear
+
 
 class Inventory(Container):
     """ Class used to create player/NPC inventories; extends Container """
 
+    # Used when no layout is given. Turned into an argument in order to make
+    # Inventory class usable by different kinds of entities; including
+    # enemies. Some could have three heads, for all I know!
+    DEFAULT_LAYOUT = GearLayout.get(("weapon", "head", "chest", "legs", "off-hand"))
+
     def __init__(self, gear: Dict=None, items: List=None, **kwargs) -> None:
+        """
+        Initialises Inventory with default values
 
-        # Turned into an argument in order to make Inventory class usable by
-        # different kinds of entities; including enemies. Some
-        # could have three heads, for all I know!
-        self.GEAR_SLOTS = kwargs.get('GEAR_SLOTS', {
-            "weapon": None,
-            "head": None,
-            "chest":  None,
-            "legs":   None,
-            "off-hand": None,
-            })
+        The gear slots are given either as a GearLayout with the layout
+        argument, or as a dictionary of empty slots with GEAR_SLOTS.
+        """
+        layout = kwargs.pop('layout', None)
+        if layout is None:
+            slots = kwargs.pop('GEAR_SLOTS', None)
+            layout = self.DEFAULT_LAYOUT if slots is None else GearLayout.get(slots)
+        self.layout = layout
 
-        super().__init__(items=items, max_capacity=kwargs.get('max_capacity', 28), name='inventory', **kwargs)
+        super().__init__(items=items, max_capacity=kwargs.pop('max_capacity', 28), name='inventory', **kwargs)
 
         if gear is None:
-            self.gear = deepcopy(self.GEAR_SLOTS)
+            self.gear = Gear(layout)
         else:
-            if len(self.GEAR_SLOTS) == len(gear):
-                for key in self.GEAR_SLOTS.keys():
+            if len(layout) == len(gear):
+                for key in layout.slots:
                     if key not in gear:
                         raise ValueError("Equipment key type mismatch")
                 else:
-                    self.gear = gear
+                    self.gear = Gear(layout, gear)
             else:
                 raise ValueError("Equipment key count mismatch")
 
+        # Attack and defence bonuses of the worn gear, kept up to date
+        # by _set_gear() so that combat code can read them cheaply
+        self.slot_stats: Dict[str, Tuple[int, int]] = {}
+        self.total_attack = 0
+        self.total_defence = 0
+        for slot, item in self.gear.items():
+            if item is not None:
+                self._set_gear(slot, item)
+
         #self.max_capacity = kwargs.get('max_capacity', 28)
 
         #if items is None:
@@ -185,15 +1482,76 @@ class Inventory(Container):
         #else:
         #    raise ValueError(f"Cannot initialise inventory with over {self.max_capacity} items")
 
+    @property
+    def GEAR_SLOTS(self) -> Dict:
+        """ The gear slots as a dictionary of empty slots, as accepted by __init__() """
+        return dict.fromkeys(self.layout.slots)
+
+    @synchronized
+    def clone(self) -> 'Inventory':
+        """ Returns an equal inventory; see Container.clone() """
+        clone = super().clone()
+        clone.gear = self.gear.copy()
+        clone.slot_stats = dict(self.slot_stats)
+        return clone
+
+    @staticmethod
+    def _item_stats(item: Union[Item, None]) -> Tuple[int, int]:
+        """ Returns the attack and defence bonuses of a worn item """
+        if item is None or item.slot not in Item.EQUIPMENT:
+            return (0, 0)
+        return (item.attack or 0, item.defence or 0)
+
+    def _set_gear(self, slot: str, item: Union[Item, None]) -> None:
+        """ Puts an item (or None) in a gear slot, updating the stat totals """
+        if item is not None:
+            item = self._standalone(item)
+        old_attack, old_defence = self.slot_stats.get(slot, (0, 0))
+        attack, defence = self.slot_stats[slot] = self._item_stats(item)
+        self.total_attack += attack - old_attack
+        self.total_defence += defence - old_defence
+        if self._listener is not None:
+            old_item = self.gear[slot]
+            if old_item is not None:
+                self._track(old_item.ID, -1)
+            if item is not None:
+                self._track(item.ID, 1)
+        self.gear._put(slot, item)
+        if self._journal is not None:
+            self._journal.record('gear', slot, None if item is None else item.to_state())
+        self._touch(slots_changed=False)
+
+    def _held_items(self) -> Iterable[Item]:
+        return self._snapshot() + [item for item in self.gear.values() if item is not None]
+
+    def _build_state(self) -> Dict:
+        state = super()._build_state()
+        state['gear'] = {slot: None if item is None else item.to_state()
+                         for slot, item in self.gear.items()}
+        return state
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'Inventory':
+        inventory = cls(gear={slot: None if item is None else Item.from_state(item)
+                              for slot, item in state['gear'].items()},
+                        items=[Item.from_state(item) for item in state['items']],
+                        layout=GearLayout.get(state['gear']),
+                        max_capacity=state['max_capacity'],
+                        container_name=state['name'])
+        inventory.mark_clean()
+        return inventory
+
+    @synchronized
     def equip(self, item: Item) -> str:
         """ Equip an item from inventory """
         try:
 
             # Ensure the inventory has an instance of the requested item
-            self.items.index(item)
+            if item not in self:
+                raise ValueError
 
             temp = self.gear[item.slot]
-            self.gear[item.slot] = item
+            self._set_gear(item.slot, item)
             self.remove(item)
             if temp is not None:
                 self.append(temp)
@@ -205,12 +1563,13 @@ class Inventory(Container):
         except ValueError:
             return "You don't have that item in your inventory"
 
+    @synchronized
     def equip_from_index(self, item_index: int) -> str:
         """ Equip an item from inventory at the specified index. """
         try:
-            item = self.items[item_index] # Find the item to be equipped
+            item = self._item_list()[item_index] # Find the item to be equipped
             temp = self.gear[item.slot]   # Temporarily store the currently equipped item (if any)
-            self.gear[item.slot] = item   # Equip item
+            self._set_gear(item.slot, item) # Equip item
             self.remove(item)             # Remove equipped item from inventory
             if temp is not None:
                 self.append(temp)
@@ -222,15 +1581,18 @@ class Inventory(Container):
         except IndexError:
             return "There's nothing in that inventory space"
 
+    @synchronized
     def unequip(self, slot: str) -> str:
         """ Unequip an item from specified gear slot """
-        if self.gear[slot] is not None:
-            self.append(self.gear[slot])
-            self.gear[slot] = None
-            return f"You unequip {self.items[-1].name}"
+        item = self.gear[slot]
+        if item is not None:
+            self.append(item)
+            self._set_gear(slot, None)
+            return f"You unequip {item.name}"
         else:
             return "That slot is empty"
 
+    @synchronized
     def combine_item(self, *items): # NOTE: Replaced by better_combine_item
                                     # DO NOT REMOVE until better_combine_item
                                     # has been fully tested
@@ -245,6 +1607,7 @@ class Inventory(Container):
         except Exception as e:
             return f"An unexpected problem has occurred: {e}"
 
+    @synchronized
     def better_combine_item(self, base_item: Item, combination: int, *materials) -> str:
         try:
             required_materials = base_item.combinations2[combination][:-1]
@@ -261,13 +1624,78 @@ class Inventory(Container):
         except Exception as e:
             return f"An unexpected problem has occurred: {e}"
 
+    @synchronized
+    def item_counts(self) -> Dict[int, int]:
+        """ Returns how many of each item ID the inventory holds, counting stack sizes """
+        counts: Dict[int, int] = {}
+        for item in self._item_list():
+            counts[item.ID] = counts.get(item.ID, 0) + (item._count if item.stackable else 1)
+        return counts
+
+    @synchronized
+    def craftable_recipes(self, file: str=ITEM_FILE) -> List[Recipe]:
+        """ Returns every recipe the inventory has the items for """
+        counts = self.item_counts()
+        return [recipe for recipe in RecipeIndex.get(file).candidates(counts)
+                if recipe.times(counts)]
+
+    @synchronized
+    def craft_max(self, recipe: Recipe, limit: int=None) -> TransactionResult:
+        """
+        Crafts a recipe as many times as the inventory's items allow, in one batch
+
+        Items of any metadata count as materials. Nothing is crafted
+        if the results wouldn't fit in the inventory.
+        """
+        counts = self.item_counts()
+        times = recipe.times(counts)
+        if limit is not None:
+            times = min(times, limit)
+        if times <= 0:
+            return TransactionResult(False, "Could not combine those items", [])
 
-class Character(ReprMixin, LevelMixin, SpritesMixin, metaclass=ABCMeta):
+        # Pick the materials from the inventory's own stacks, in slot order
+        remaining = {ID: amount * times for ID, amount in recipe.requirements.items()}
+        materials = []
+        for item in self._item_list():
+            needed = remaining.get(item.ID, 0)
+            if not needed:
+                continue
+            if item.stackable:
+                taken = min(needed, item._count)
+                materials.append(Item.from_definition(item.definition, item.metadata, taken))
+            else:
+                taken = 1
+                materials.append(item)
+            remaining[item.ID] = needed - taken
+
+        definition = ItemDefinition.get(recipe.result)
+        if definition.stackable:
+            results = [Item.from_definition(definition, count=times)]
+        else:
+            results = [Item.from_definition(definition) for _ in range(times)]
+
+        required, _ = self._plan_remove(materials)
+        _, new_slots = self._plan_add(results)
+        if len(self) - self._slots_freed(required) + len(new_slots) > self.max_capacity:
+            return TransactionResult(False, "No room in inventory", [])
+        self._apply_remove(required)
+        self._apply_add(*self._plan_add(results))
+        return TransactionResult(True, f"Crafted {times} {definition.name}", results)
+
+
+class Character(ReprMixin, LevelMixin, SpritesMixin, StateMixin, metaclass=ABCMeta):
     """ Base class for creating characters """
     #TODO: add more methods
 
     def __init__(self, name, inventory: Inventory=None, **kwargs) -> None:
-        self.name = name
+        """
+        Initialises a character and adds it to a registry
+
+        The registry defaults to registry.WORLD; pass registry=None to leave it out.
+        """
+        self._registry = None
+        self._name = name
         inventory_size = kwargs.get('inventory_size', 28)
         if inventory is None:
             self.inventory = Inventory(capacity=inventory_size)
@@ -275,7 +1703,62 @@ class Character(ReprMixin, LevelMixin, SpritesMixin, metaclass=ABCMeta):
             self.inventory: Inventory = inventory
         #super(Character, self).__init__(**kwargs)
         LevelMixin.__init__(self, **kwargs)
-        self.load_char_sprites(self.name)
+        registry = kwargs.get('registry', WORLD)
+        if registry is not None:
+            registry.register(self)
+
+    def _repr_items(self):
+        return ((key, value) for key, value in super()._repr_items() if key != '_registry')
+
+    def __getstate__(self) -> Dict:
+        # Registries hold weak references, which can't be pickled; an
+        # unpickled character rejoins WORLD if the original was in it
+        state = self.__dict__.copy()
+        state['_registry'] = self._registry is WORLD
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        in_world = state.pop('_registry')
+        self.__dict__.update(state)
+        self._registry = None
+        if in_world:
+            WORLD.register(self)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name: str) -> None:
+        self._name = name
+        if self._registry is not None:
+            self._registry._renamed(self)
+
+    def _level_changed(self) -> None:
+        if self._registry is not None:
+            self._registry._level_changed(self)
+
+    @property
+    def sprites(self) -> List:
+        """ The character's sprites; looked up when accessed instead of on creation """
+        return self.load_char_sprites(self.name)
+
+    def to_state(self) -> Dict:
+        """ Returns the character's state as plain data; the inventory's state is reused if it hasn't changed """
+        return {
+            'name': self.name,
+            'level': self.level,
+            'exp': self.experience,
+            'exponent': self.exponent,
+            'base_exp': self._base_exp,
+            'max_level': self.max_level,
+            'inventory': self.inventory.to_state(),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'Character':
+        state = dict(state)
+        return cls(state.pop('name'), inventory=Inventory.from_state(state.pop('inventory')), **state)
 
 class Player(Character):
     """ Base class for player objects """
@@ -0,0 +1,539 @@
+#! python3
+
+"""
+Streaming validation and indexing of game data files
+
+Data files are read one record at a time, so that files of any size can be
+checked without loading them whole:
+- scan() yields the raw bytes and location of every record of a file
+- validate() checks the records against the schema of their section, and
+  checks that the item IDs they refer to (combine2 recipes, loot, quest
+  rewards and so on) exist
+- build_index() writes a sidecar index next to a data file, listing where
+  every record is; while the data file is unchanged, DataCatalog reads
+  single records through the index instead of parsing the whole file
+
+Run this module to validate and index every data file listed in settings.py.
+
+In TOML files, records are split at table headers ([section.ID]), which may
+be indented and use quoted keys. A header the scanner can't read is an error,
+rather than a record silently merged into the one before it.
+"""
+
+# Built-in libraries
+import os
+import re
+import sys
+import json
+
+from typing import List, Dict, Any, Iterable, Iterator, NamedTuple, Union
+
+# 3rd-party libraries
+# toml is imported on first use, as it is slow to import
+
+# Local libraries
+from settings import DATA_FORMAT, DATA_FILES, DATA_INDEX_SUFFIX, ITEM_FILE
+
+__all__ = [
+    'RawRecord',
+    'Problem',
+    'scan',
+    'decode_record',
+    'validate',
+    'index_path',
+    'build_index',
+    'DataIndex',
+]
+
+
+INDEX_VERSION = 1
+
+# Gear slots and item types an item's 'type' can be
+ITEM_TYPES = ('weapon', 'off-hand', 'head', 'chest', 'legs', 'item')
+NPC_TYPES = ('shop', 'bank', 'quest', 'none')
+
+
+class RawRecord(NamedTuple):
+    """ A record of a data file, as found by scan() """
+    section: str
+    ID: str
+    offset: int
+    raw: bytes
+
+
+class Problem(NamedTuple):
+    """ Something validate() found wrong with a data file """
+    file: str
+    section: Union[str, None]
+    ID: Union[str, None]
+    message: str
+
+    def __str__(self) -> str:
+        if self.section is None:
+            return f"{self.file}: {self.message}"
+        return f"{self.file}: {self.section}.{self.ID}: {self.message}"
+
+
+# Scanning
+
+_WHITESPACE = re.compile(rb'\s*')
+_JSON_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+# A lone quote means a string that continues past the end of the buffer
+_JSON_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|"|[{}\[\]]', re.S)
+_JSON_SCALAR_END = re.compile(rb'[\s,}\]]')
+# A bare, "basic" or 'literal' TOML key
+_TOML_KEY = rb'[A-Za-z0-9_-]+|"(?:[^"\\\n]|\\.)*"|\'[^\'\n]*\''
+_TOML_HEADER = re.compile(rb'[ \t]*\[\[?[ \t]*(' + _TOML_KEY + rb')[ \t]*(?:\.[ \t]*(' + _TOML_KEY + rb')[ \t]*)?'
+                          rb'(?:\.[ \t]*(?:' + _TOML_KEY + rb')[ \t]*)*\]\]?[ \t]*(?:#.*)?$')
+# What changes whether the next line is at the top level: brackets and strings
+_TOML_TOKEN = re.compile(rb'"""|\'\'\'|"(?:[^"\\\n]|\\.)*"|\'[^\'\n]*\'|#|[\[\]{}]')
+_TOML_STRING_END = {b'"""': re.compile(rb'(?:[^\\]|\\.)*?"""', re.S), b"'''": re.compile(rb".*?'''", re.S)}
+
+
+def _value_end(buffer: bytes, pos: int) -> Union[int, None]:
+    """ Returns where the JSON value starting at pos ends, or None if it isn't all in the buffer """
+    first = buffer[pos:pos + 1]
+    if not first:
+        return None
+    if first == b'"':
+        match = _JSON_STRING.match(buffer, pos)
+        return match.end() if match else None
+    if first in (b'{', b'['):
+        depth = 0
+        for match in _JSON_TOKEN.finditer(buffer, pos):
+            token = match.group()
+            if token == b'"':
+                return None
+            if token in (b'{', b'['):
+                depth += 1
+            elif token in (b'}', b']'):
+                depth -= 1
+                if not depth:
+                    return match.end()
+        return None
+    match = _JSON_SCALAR_END.search(buffer, pos)
+    return match.start() if match else None
+
+
+class _JSONStream:
+    """ Reads the tokens of a JSON file from a sliding buffer """
+
+    def __init__(self, f: Any, chunk_size: int) -> None:
+        self._file = f
+        self._chunk_size = chunk_size
+        self.buffer = b""
+        # File offset of the start of the buffer, and the read position in the buffer
+        self.start = 0
+        self.pos = 0
+
+    def _more(self) -> bool:
+        """ Reads another chunk, dropping what has already been consumed """
+        data = self._file.read(self._chunk_size)
+        if not data:
+            return False
+        self.start += self.pos
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> bytes:
+        """ Skips whitespace and returns the next byte; empty at the end of the file """
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._more():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, token: bytes) -> None:
+        if self.peek() != token:
+            raise ValueError(f"Expected {token.decode()!r} at byte {self.start + self.pos}")
+        self.pos += 1
+
+    def value(self) -> tuple:
+        """ Returns the file offset and raw bytes of the next value """
+        self.peek()
+        while True:
+            end = _value_end(self.buffer, self.pos)
+            if end is not None:
+                break
+            if not self._more():
+                raise ValueError(f"Unexpected end of file in the value at byte {self.start + self.pos}")
+        offset = self.start + self.pos
+        raw = self.buffer[self.pos:end]
+        self.pos = end
+        return offset, raw
+
+    def key(self) -> str:
+        offset, raw = self.value()
+        if not raw.startswith(b'"'):
+            raise ValueError(f"Expected a string key at byte {offset}")
+        key = json.loads(raw.decode())
+        self.expect(b':')
+        return key
+
+
+def _scan_json(f: Any, chunk_size: int) -> Iterator[RawRecord]:
+    stream = _JSONStream(f, chunk_size)
+    stream.expect(b'{')
+    if stream.peek() == b'}':
+        return
+    while True:
+        section = stream.key()
+        if stream.peek() == b'{':
+            stream.expect(b'{')
+            if stream.peek() != b'}':
+                while True:
+                    ID = stream.key()
+                    offset, raw = stream.value()
+                    yield RawRecord(section, ID, offset, raw)
+                    if stream.peek() != b',':
+                        break
+                    stream.pos += 1
+            stream.expect(b'}')
+        else:
+            # Not a section of records
+            stream.value()
+        if stream.peek() != b',':
+            break
+        stream.pos += 1
+    stream.expect(b'}')
+
+
+def _toml_key(raw: bytes) -> str:
+    """ Returns the name of a bare or quoted TOML key """
+    if raw[:1] == b'"':
+        return json.loads(raw.decode())
+    if raw[:1] == b"'":
+        return raw[1:-1].decode()
+    return raw.decode()
+
+
+def _scan_toml(f: Any) -> Iterator[RawRecord]:
+    current = None
+    lines: List[bytes] = []
+    offset = 0
+    # Brackets open over the end of the line, and the delimiter of a multi-line string going on
+    depth = 0
+    string_end = None
+    for line in f:
+        pos = 0
+        if string_end is not None:
+            match = string_end.match(line)
+            pos = match.end() if match else len(line)
+            if match:
+                string_end = None
+        elif not depth and line.lstrip()[:1] == b'[':
+            # At the top level, a line starting with a bracket can only be a table header
+            match = _TOML_HEADER.match(line.rstrip(b'\r\n'))
+            if match is None:
+                raise ValueError(f"Unsupported table header at byte {offset}: {line.strip().decode(errors='replace')}")
+            section, ID = (None if group is None else _toml_key(group) for group in match.groups())
+            if current is None or (section, ID) != current[:2]:
+                if current is not None and current[1] is not None:
+                    yield RawRecord(current[0], current[1], current[2], b"".join(lines))
+                current = (section, ID, offset)
+                lines = []
+            pos = len(line)
+        while string_end is None:
+            token = _TOML_TOKEN.search(line, pos)
+            if token is None or token.group() == b'#':
+                break
+            pos = token.end()
+            if token.group() in _TOML_STRING_END:
+                match = _TOML_STRING_END[token.group()].match(line, pos)
+                if match is None:
+                    string_end = _TOML_STRING_END[token.group()]
+                else:
+                    pos = match.end()
+            elif token.group() in (b'[', b'{'):
+                depth += 1
+            elif token.group() in (b']', b'}'):
+                depth -= 1
+        if current is not None and current[1] is not None:
+            lines.append(line)
+        offset += len(line)
+    if current is not None and current[1] is not None:
+        yield RawRecord(current[0], current[1], current[2], b"".join(lines))
+
+
+def scan(file: str, file_format: str=DATA_FORMAT, chunk_size: int=1 << 16) -> Iterator[RawRecord]:
+    """
+    Yields every record of a data file without reading the whole file into memory
+
+    Raises ValueError if the structure of the file is broken.
+    """
+    with open(file, 'rb') as f:
+        if file_format == "json":
+            yield from _scan_json(f, chunk_size)
+        elif file_format == "toml":
+            yield from _scan_toml(f)
+        else:
+            raise NotImplementedError(f"Missing support for opening files of type: {file_format}")
+
+
+def decode_record(raw: bytes, section: str, ID: str, file_format: str=DATA_FORMAT) -> Any:
+    """ Parses the raw bytes of a single record """
+    if file_format == "json":
+        return json.loads(raw.decode())
+    elif file_format == "toml":
+        import toml
+        return toml.loads(raw.decode())[section][ID]
+    raise NotImplementedError(f"Missing support for opening files of type: {file_format}")
+
+
+# Validation
+
+def _check_name(record: Dict, refs: List) -> Iterator[str]:
+    if not isinstance(record.get('name', None), str):
+        yield "missing or non-string 'name'"
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_int(record: Dict, key: str) -> Iterator[str]:
+    if not _is_int(record.get(key, 0)):
+        yield f"'{key}' is not an integer"
+
+
+def _check_list(record: Dict, key: str) -> Iterator[str]:
+    if not isinstance(record.get(key, None) or [], list):
+        yield f"'{key}' is not an array"
+
+
+def _check_item(record: Dict, refs: List) -> Iterator[str]:
+    yield from _check_name(record, refs)
+    if record.get('type', None) not in ITEM_TYPES:
+        yield f"'type' must be one of {', '.join(ITEM_TYPES)}"
+    if not isinstance(record.get('stackable', False), bool):
+        yield "'stackable' is not a boolean"
+    # Stackable items describe a single item and a stack, which is formatted with its size
+    examine = record.get('examine', None)
+    if record.get('stackable', False) is True:
+        if not isinstance(examine, list) or len(examine) != 2 or not all(isinstance(text, str) for text in examine):
+            yield "stackable items need 'examine' to be a pair of strings"
+    elif not isinstance(examine, str):
+        yield "missing or non-string 'examine'"
+    yield from _check_int(record, 'atk')
+    yield from _check_int(record, 'def')
+
+    combine = record.get('combine', None)
+    if combine is not None:
+        if not isinstance(combine, dict):
+            yield "'combine' is not a table"
+        else:
+            for material, result in combine.items():
+                refs.append((material, "combine material"))
+                refs.append((result, "combine result"))
+
+    yield from _check_list(record, 'combine2')
+    combinations2 = record.get('combine2', None)
+    for recipe in combinations2 if isinstance(combinations2, list) else ():
+        if not isinstance(recipe, list) or len(recipe) < 2:
+            yield f"combine2 recipe {recipe!r} needs at least one material and a result"
+            continue
+        for material in recipe[:-1]:
+            refs.append((material, "combine2 material"))
+        refs.append((recipe[-1], "combine2 result"))
+
+
+def _check_enemy(record: Dict, refs: List) -> Iterator[str]:
+    yield from _check_name(record, refs)
+    if 'level' not in record:
+        yield "missing 'level'"
+    yield from _check_int(record, 'level')
+    if not isinstance(record.get('canLevelUp', False), bool):
+        yield "'canLevelUp' is not a boolean"
+    yield from _check_int(record, 'lootRolls')
+    yield from _check_list(record, 'loot')
+    loot = record.get('loot', None)
+    for entry in loot if isinstance(loot, list) else ():
+        if not isinstance(entry, dict):
+            yield f"loot entry {entry!r} is not a table"
+            continue
+        if 'item' in entry:
+            refs.append((entry['item'], "loot item"))
+        weight = entry.get('weight', 1)
+        if not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight < 0:
+            yield f"loot entry {entry!r} has an invalid weight"
+        low = entry.get('min', 1)
+        high = entry.get('max', low)
+        if not _is_int(low) or not _is_int(high):
+            yield f"loot entry {entry!r} has a non-integer stack size"
+        elif low > high:
+            yield f"loot entry {entry!r} has min over max"
+
+
+def _check_npc(record: Dict, refs: List) -> Iterator[str]:
+    yield from _check_name(record, refs)
+    if record.get('type', 'none') not in NPC_TYPES:
+        yield f"'type' must be one of {', '.join(NPC_TYPES)}"
+
+
+def _check_quest(record: Dict, refs: List) -> Iterator[str]:
+    yield from _check_name(record, refs)
+    rewards = record.get('rewards', None) or {}
+    if not isinstance(rewards, dict):
+        yield "'rewards' is not a table"
+        return
+    yield from _check_list(rewards, 'items')
+    items = rewards.get('items', None)
+    for reward in items if isinstance(items, list) else ():
+        if not isinstance(reward, list) or len(reward) != 2:
+            yield f"item reward {reward!r} is not an [ID, amount] pair"
+            continue
+        refs.append((reward[0], "reward item"))
+
+
+# Section name -> function yielding the problems of a record of that section;
+# other sections only need their records to have a name
+SECTION_CHECKS = {
+    'items': _check_item,
+    'enemies': _check_enemy,
+    'npc': _check_npc,
+    'NPCs': _check_npc,
+    'quests': _check_quest,
+}
+
+
+def _format_of(file: str, default: str) -> str:
+    """ Guesses a data file's format from its extension """
+    extension = os.path.splitext(file)[1].lstrip('.').lower()
+    return extension if extension in ("json", "toml") else default
+
+
+def validate(files: Iterable[str], file_format: str=DATA_FORMAT, item_file: str=ITEM_FILE,
+             write_index: bool=False) -> List[Problem]:
+    """
+    Checks data files record by record and returns every problem found
+
+    Files ending in .json or .toml are read in that format, others in
+    file_format. Item references are checked against the items sections of
+    the given files, or of item_file if none of them has one. With
+    write_index=True, an index is written for every file whose structure
+    could be read, whether or not its records have problems.
+    """
+    problems: List[Problem] = []
+    item_ids = set()
+    has_items = False
+    # (file, section, ID, referenced ID, what refers to it)
+    references: List[tuple] = []
+
+    for file in files:
+        fmt = _format_of(file, file_format)
+        index: Dict[str, Dict[str, List[int]]] = {}
+        try:
+            for section, ID, offset, raw in scan(file, fmt):
+                entries = index.setdefault(section, {})
+                if ID in entries:
+                    problems.append(Problem(file, section, ID, "duplicate ID"))
+                entries[ID] = [offset, len(raw)]
+                try:
+                    record = decode_record(raw, section, ID, fmt)
+                except Exception as e:
+                    problems.append(Problem(file, section, ID, f"unreadable record: {e}"))
+                    continue
+                if section == 'items':
+                    has_items = True
+                    item_ids.add(ID)
+                if not isinstance(record, dict):
+                    problems.append(Problem(file, section, ID, "record is not a table"))
+                    continue
+                refs: List[tuple] = []
+                for message in SECTION_CHECKS.get(section, _check_name)(record, refs):
+                    problems.append(Problem(file, section, ID, message))
+                references.extend((file, section, ID, ref, what) for ref, what in refs)
+        except ValueError as e:
+            problems.append(Problem(file, None, None, str(e)))
+            continue
+        if write_index:
+            _write_index(file, fmt, index)
+
+    if references and not has_items and os.path.exists(item_file):
+        item_ids.update(ID for section, ID, _, _ in scan(item_file, _format_of(item_file, file_format))
+                        if section == 'items')
+    if has_items or item_ids:
+        for file, section, ID, ref, what in references:
+            if str(ref) not in item_ids:
+                problems.append(Problem(file, section, ID, f"{what} {ref!r} is not an item ID"))
+    return problems
+
+
+# Indexing
+
+def index_path(file: str) -> str:
+    """ Returns the path of a data file's sidecar index """
+    return file + DATA_INDEX_SUFFIX
+
+
+def _signature(file: str) -> List[int]:
+    stat = os.stat(file)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _write_index(file: str, file_format: str, sections: Dict) -> None:
+    index = {
+        "version": INDEX_VERSION,
+        "format": file_format,
+        "source": _signature(file),
+        "sections": sections,
+    }
+    with open(index_path(file), 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+
+
+def build_index(file: str, file_format: str=DATA_FORMAT) -> str:
+    """ Writes the sidecar index of a data file, without validating it, and returns its path """
+    sections: Dict[str, Dict[str, List[int]]] = {}
+    for section, ID, offset, raw in scan(file, file_format):
+        sections.setdefault(section, {})[ID] = [offset, len(raw)]
+    _write_index(file, file_format, sections)
+    return index_path(file)
+
+
+class DataIndex:
+    """ Reads single records of a data file through its sidecar index """
+
+    def __init__(self, file: str, index: Dict) -> None:
+        self.file = file
+        self.file_format = index["format"]
+        self._sections: Dict[str, Dict[str, List[int]]] = index["sections"]
+
+    @classmethod
+    def open(cls, file: str, signature: tuple=None) -> Union['DataIndex', None]:
+        """
+        Returns the index of a data file, or None if there is none or it is out of date
+
+        signature is the file's (mtime in nanoseconds, size), if already known.
+        """
+        try:
+            with open(index_path(file)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if signature is None:
+            signature = _signature(file)
+        if index.get("version") != INDEX_VERSION or tuple(index.get("source", ())) != tuple(signature):
+            return None
+        return cls(file, index)
+
+    def get(self, section: str, ID: Any) -> Any:
+        """
+        Reads and decodes a single record; raises KeyError if it doesn't exist
+
+        Records aren't kept, DataCatalog caches them.
+        """
+        offset, length = self._sections[section][str(ID)]
+        with open(self.file, 'rb') as f:
+            f.seek(offset)
+            raw = f.read(length)
+        return decode_record(raw, section, str(ID), self.file_format)
+
+
+if __name__ == "__main__":
+    # Validate and index the given data files, or every data file listed in settings.py that exists
+    sources = sys.argv[1:] or [file for file in DATA_FILES if os.path.exists(file)]
+    found = validate(sources, write_index=True)
+    for problem in found:
+        print(problem)
+    sys.exit(1 if found else 0)
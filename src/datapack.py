@@ -0,0 +1,183 @@
+#! python3
+
+"""
+Precompiled, memory-mapped game data packs
+
+The JSON/TOML data files remain the authoring format; build_pack() compiles
+them into a single binary file that DataCatalog reads one record at a time.
+
+Layout of a pack file:
+- header: magic bytes, format version and the location of the section table
+- indexes: one per section, fixed-size entries sorted by ID
+- keys and records: the IDs and compact JSON records the index entries point to
+- section table: JSON describing every source file (its SHA-1 digest) and
+  where each of its sections' indexes starts and how many entries it has
+
+Source files are identified by their path relative to the data directory,
+so a file of the same name elsewhere, eg. in a mod, is never read from the
+pack.
+"""
+
+# Built-in libraries
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+
+from typing import List, Dict, Any, Iterable
+
+# 3rd-party libraries
+# None
+
+# Local libraries
+from settings import DATA_DIR, DATA_FORMAT, DATA_FILES, DATA_PACK_FILE
+
+__all__ = [
+    'file_digest',
+    'pack_name',
+    'build_pack',
+    'DataPack',
+]
+
+
+MAGIC = b"RPGPACK\0"
+VERSION = 2
+
+# magic, version, section table offset, section table length
+HEADER = struct.Struct("<8sHQI")
+# key offset, key length, record offset, record length
+ENTRY = struct.Struct("<QIQI")
+
+
+def file_digest(file: str) -> str:
+    """ Returns the SHA-1 digest of a file, used to tell if a pack is out of date """
+    digest = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pack_name(file: str, root: str=DATA_DIR) -> str:
+    """ Returns the name a data file is stored under in a pack: its path relative to root """
+    try:
+        name = os.path.relpath(os.path.abspath(file), os.path.abspath(root))
+    except ValueError:
+        # On another drive than root
+        name = os.path.abspath(file)
+    return name.replace(os.sep, '/')
+
+
+def build_pack(files: Iterable[str], output: str, file_format: str=DATA_FORMAT, root: str=DATA_DIR) -> None:
+    """ Compiles the given data files into a single pack file """
+    from mixins import DataCatalog
+
+    table: Dict[str, Any] = {"files": {}, "sections": {}}
+    indexes: List[List] = []
+    blob = bytearray()
+    for file in files:
+        name = pack_name(file, root)
+        table["files"][name] = file_digest(file)
+        table["sections"][name] = sections = {}
+        for section, entries in DataCatalog._parse(file, file_format).items():
+            if not isinstance(entries, dict):
+                continue
+            index = []
+            for ID, value in entries.items():
+                key = str(ID).encode()
+                record = json.dumps(value, separators=(',', ':')).encode()
+                index.append((key, len(blob), len(record)))
+                blob += key + record
+            index.sort()
+            sections[section] = [len(indexes), len(index)]
+            indexes.append(index)
+
+    # Indexes come right after the header, followed by the keys and records
+    offset = HEADER.size
+    starts = []
+    for index in indexes:
+        starts.append(offset)
+        offset += len(index) * ENTRY.size
+    data_start = offset
+    for sections in table["sections"].values():
+        for entry in sections.values():
+            entry[0] = starts[entry[0]]
+    encoded = json.dumps(table, separators=(',', ':')).encode()
+
+    with open(output, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, data_start + len(blob), len(encoded)))
+        for index in indexes:
+            for key, key_offset, record_length in index:
+                f.write(ENTRY.pack(data_start + key_offset, len(key),
+                                   data_start + key_offset + len(key), record_length))
+        f.write(blob)
+        f.write(encoded)
+
+
+class DataPack:
+    """ Read-only, memory-mapped access to a pack built with build_pack() """
+
+    def __init__(self, path: str, root: str=DATA_DIR) -> None:
+        self.path = path
+        self.root = root
+        # file path -> pack_name() of it
+        self._names: Dict[str, str] = {}
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, table_offset, table_length = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {VERSION} data pack")
+        table = json.loads(self._map[table_offset:table_offset + table_length].decode())
+        self.files: Dict[str, str] = table["files"]
+        self._sections: Dict[str, Dict] = table["sections"]
+
+    def _name(self, file: str) -> str:
+        name = self._names.get(file)
+        if name is None:
+            name = self._names[file] = pack_name(file, self.root)
+        return name
+
+    def covers(self, file: str) -> bool:
+        """ Tells if the pack was built from the given data file """
+        return self._name(file) in self.files
+
+    def digest(self, file: str) -> str:
+        """ Returns the digest of the source file the pack was built from """
+        return self.files[self._name(file)]
+
+    def get(self, file: str, section: str, ID: Any) -> Dict:
+        """
+        Decodes a single record; raises KeyError if it doesn't exist
+
+        Records aren't kept, DataCatalog caches them.
+        """
+        name = self._name(file)
+        key = str(ID)
+        start, count = self._sections[name][section]
+        wanted = key.encode()
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, record_offset, record_length = ENTRY.unpack_from(
+                self._map, start + middle * ENTRY.size)
+            found = self._map[key_offset:key_offset + key_length]
+            if found < wanted:
+                low = middle + 1
+            elif found > wanted:
+                high = middle
+            else:
+                raw = self._map[record_offset:record_offset + record_length]
+                return json.loads(raw.decode())
+        raise KeyError(key)
+
+    def close(self) -> None:
+        self._map.close()
+
+
+if __name__ == "__main__":
+    # Compile every data file listed in settings.py that exists
+    sources = [file for file in DATA_FILES if os.path.exists(file)]
+    build_pack(sources, sys.argv[1] if len(sys.argv) > 1 else DATA_PACK_FILE)
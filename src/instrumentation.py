@@ -0,0 +1,192 @@
+#! python3
+
+"""
+Opt-in instrumentation of RPGenie's hot paths
+
+enable() wraps data file lookups, Container/Inventory operations and sprite
+scans with timing wrappers; disable() puts the original methods back, so
+instrumentation costs nothing while it is off. snapshot() returns every
+counter as plain data for a metrics exporter to poll, and profile() runs
+cProfile over a block of game logic.
+
+Container operations only count the outermost call made by a thread, so
+CompactContainer.remove() isn't also counted as Container.remove(), nor the
+removal Inventory.equip() makes as a call of its own. Data and sprite
+lookups are counted wherever they are made from.
+
+The counters aren't locked; with several threads they are approximate.
+"""
+
+# Built-in libraries
+import time
+import cProfile
+import threading
+import pstats
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import List, Dict, Any, Callable
+
+# 3rd-party libraries
+# None
+
+# Local libraries
+from mixins import CATALOG, DataCatalog, SpriteRegistry
+from classes import Container, CompactContainer, Inventory
+
+__all__ = [
+    'BUCKETS',
+    'TARGETS',
+    'Timer',
+    'is_enabled',
+    'enable',
+    'disable',
+    'reset',
+    'snapshot',
+    'profile',
+]
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, float('inf'))
+
+# (class, method name, metric name) of everything enable() instruments
+TARGETS = (
+    (DataCatalog, 'get', 'data.lookups'),
+    (DataCatalog, '_parse', 'data.parses'),
+    (SpriteRegistry, 'get', 'sprites.lookups'),
+    (SpriteRegistry, '_scan', 'sprites.scans'),
+    (Container, 'append', 'Container.append'),
+    (Container, 'remove', 'Container.remove'),
+    (Container, 'add_many', 'Container.add_many'),
+    (Container, 'remove_many', 'Container.remove_many'),
+    (Container, 'transfer', 'Container.transfer'),
+    (CompactContainer, 'remove', 'CompactContainer.remove'),
+    (CompactContainer, 'remove_many', 'CompactContainer.remove_many'),
+    (Inventory, 'equip', 'Inventory.equip'),
+    (Inventory, 'equip_from_index', 'Inventory.equip_from_index'),
+    (Inventory, 'unequip', 'Inventory.unequip'),
+    (Inventory, 'craft_max', 'Inventory.craft_max'),
+)
+
+
+class Timer:
+    """ Call count, total time and latency histogram of a single metric """
+
+    __slots__ = ('count', 'total', 'buckets',)
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'histogram': dict(zip(map(str, BUCKETS), self.buckets)),
+        }
+
+
+_timers: Dict[str, Timer] = {}
+# (class, method name) -> the original class attribute
+_originals: Dict[tuple, Any] = {}
+
+
+# Per-thread flag set while an instrumented container operation runs
+_local = threading.local()
+
+
+def _timed(function: Callable, timer: Timer) -> Callable:
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer.record(time.perf_counter() - start)
+    return wrapper
+
+
+def _timed_outermost(function: Callable, timer: Timer) -> Callable:
+    """ Like _timed(), but calls made from inside another container operation aren't recorded """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, 'busy', False):
+            return function(*args, **kwargs)
+        _local.busy = True
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer.record(time.perf_counter() - start)
+            _local.busy = False
+    return wrapper
+
+
+def is_enabled() -> bool:
+    return bool(_originals)
+
+
+def enable() -> None:
+    """ Starts collecting metrics """
+    if is_enabled():
+        return
+    for cls, name, metric in TARGETS:
+        original = cls.__dict__[name]
+        timer = _timers.setdefault(metric, Timer())
+        timed = _timed_outermost if issubclass(cls, Container) else _timed
+        if isinstance(original, staticmethod):
+            wrapped = staticmethod(timed(original.__func__, timer))
+        else:
+            wrapped = timed(original, timer)
+        _originals[(cls, name)] = original
+        setattr(cls, name, wrapped)
+
+
+def disable() -> None:
+    """ Stops collecting metrics, restoring the original methods; collected metrics are kept """
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+
+
+def reset() -> None:
+    """ Forgets every collected metric """
+    for timer in _timers.values():
+        timer.__init__()
+    CATALOG.cache.reset_stats()
+
+
+def snapshot() -> Dict[str, Any]:
+    """ Returns every metric as plain data """
+    metrics = {metric: timer.as_dict() for metric, timer in _timers.items()}
+    # Reads from the data pack or a sidecar index don't parse anything, but
+    # are still misses; only the record cache knows what was served from memory
+    cache = metrics['data.cache'] = CATALOG.cache.stats()
+    metrics['data.hits'] = cache['hits']
+    metrics['data.misses'] = cache['misses']
+    return metrics
+
+
+@contextmanager
+def profile(sort: str='cumulative', limit: int=20, stream=None):
+    """
+    Runs cProfile over the block and prints the top entries afterwards
+
+    Yields the cProfile.Profile object for further inspection.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if limit:
+            pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(limit)
@@ -0,0 +1,174 @@
+#! python3
+
+"""
+Loot tables driven by the enemy data file
+
+An enemy's drops are listed under its optional 'loot' key, as entries with
+an item ID, a weight and a stack size range. Every roll picks one entry, in
+proportion to the weights; entries without an item drop nothing. The
+optional 'lootRolls' key sets how many rolls one kill makes (default 1).
+
+Tables are compiled into Walker's alias method, so picking an entry takes
+constant time however long the table is. Large batches are rolled with
+NumPy when it is installed. Results are (item ID, count) aggregates that
+Container.add_counts() stores without creating an Item per drop.
+"""
+
+# Built-in libraries
+import random
+
+from typing import List, Dict, Any, Tuple, NamedTuple, Union
+
+# 3rd-party libraries
+# None
+
+# Local libraries
+from settings import DATA_FORMAT, ENEMY_FILE
+from mixins import CATALOG, _numpy
+
+__all__ = [
+    'LootEntry',
+    'LootTable',
+    'roll',
+]
+
+
+class LootEntry(NamedTuple):
+    """ A single row of a loot table; ID is None for a roll that drops nothing """
+    ID: Union[int, None]
+    weight: float
+    min: int
+    max: int
+
+
+class LootTable:
+    """
+    The compiled loot table of one enemy
+
+    Use LootTable.get() to share one table per enemy; it is rebuilt
+    whenever the enemy data file changes.
+    """
+
+    # Batches at least this large are rolled with NumPy, if it is available
+    NUMPY_THRESHOLD = 4096
+    # Number of rolls NumPy makes at a time, to keep memory use flat
+    CHUNK_SIZE = 1 << 20
+
+    # (enemy ID, file) -> LootTable
+    _tables: Dict[tuple, 'LootTable'] = {}
+
+    def __init__(self, entries: List[LootEntry], rolls: int=1, generation: int=0) -> None:
+        if any(entry.weight < 0 for entry in entries):
+            raise ValueError("Loot weights cannot be negative")
+        if any(entry.min > entry.max for entry in entries):
+            raise ValueError("Loot stack size minimum cannot exceed the maximum")
+        self.entries = [entry for entry in entries if entry.weight > 0]
+        self.rolls = rolls
+        # The data file's generation (see DataCatalog.generation()) the table was built from
+        self._generation = generation
+        self._probability, self._alias = self._build_alias([entry.weight for entry in self.entries])
+
+    @staticmethod
+    def _build_alias(weights: List[float]) -> Tuple[List[float], List[int]]:
+        """ Compiles weights into the probability and alias columns of Vose's alias method """
+        size = len(weights)
+        if not size:
+            return [], []
+        total = sum(weights)
+        scaled = [weight * size / total for weight in weights]
+        probability = [1.0] * size
+        alias = list(range(size))
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probability[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Whatever is left over is 1.0 give or take rounding errors
+        return probability, alias
+
+    @classmethod
+    def from_data(cls, enemy_data: Dict, generation: int=0) -> 'LootTable':
+        """ Builds a table from an enemy's data """
+        entries = []
+        for entry in enemy_data.get('loot', None) or ():
+            ID = entry.get('item', None)
+            low = entry.get('min', 1)
+            entries.append(LootEntry(None if ID is None else int(ID), entry.get('weight', 1),
+                                     low, entry.get('max', low)))
+        return cls(entries, enemy_data.get('lootRolls', 1), generation)
+
+    @classmethod
+    def get(cls, enemy_id: int, file: str=ENEMY_FILE, file_format: str=DATA_FORMAT) -> 'LootTable':
+        """ Returns the shared loot table of an enemy """
+        key = (int(enemy_id), file)
+        generation = CATALOG.generation(file)
+        table = cls._tables.get(key)
+        if table is None or table._generation != generation:
+            enemy_data = CATALOG.get(enemy_id, 'enemies', file, file_format)
+            table = cls._tables[key] = cls.from_data(enemy_data, generation)
+        return table
+
+    def roll(self, n: int=1, rng: random.Random=None) -> List[Tuple[int, int]]:
+        """
+        Rolls the drops of n kills and returns how many of each item dropped
+
+        Pass a seeded random.Random as rng to get repeatable results. The
+        NumPy and pure Python code paths draw different random numbers, so
+        the same rng gives different (equally distributed) results depending
+        on whether NumPy is installed.
+        """
+        rolls = n * self.rolls
+        if not self.entries or rolls <= 0:
+            return []
+        if rng is None:
+            rng = random
+        numpy = _numpy() if rolls >= self.NUMPY_THRESHOLD else None
+        if numpy is not None:
+            totals = self._roll_numpy(numpy, rolls, rng)
+        else:
+            totals = self._roll_python(rolls, rng)
+
+        # Entries may share an item ID; report every ID once, in table order
+        counts: Dict[int, int] = {}
+        for entry, total in zip(self.entries, totals):
+            if entry.ID is not None and total:
+                counts[entry.ID] = counts.get(entry.ID, 0) + total
+        return list(counts.items())
+
+    def _roll_python(self, rolls: int, rng: random.Random) -> List[int]:
+        """ Returns the total stack size dropped by every entry """
+        entries, probability, alias = self.entries, self._probability, self._alias
+        size = len(entries)
+        totals = [0] * size
+        for _ in range(rolls):
+            column = int(rng.random() * size)
+            if rng.random() >= probability[column]:
+                column = alias[column]
+            entry = entries[column]
+            totals[column] += entry.min if entry.min == entry.max else rng.randint(entry.min, entry.max)
+        return totals
+
+    def _roll_numpy(self, numpy: Any, rolls: int, rng: random.Random) -> List[int]:
+        """ Vectorised version of _roll_python() """
+        generator = numpy.random.default_rng(rng.getrandbits(64))
+        probability = numpy.array(self._probability)
+        alias = numpy.array(self._alias)
+        low = numpy.array([entry.min for entry in self.entries])
+        high = numpy.array([entry.max for entry in self.entries]) + 1
+        totals = numpy.zeros(len(self.entries), dtype=numpy.int64)
+        for start in range(0, rolls, self.CHUNK_SIZE):
+            size = min(self.CHUNK_SIZE, rolls - start)
+            columns = generator.integers(0, len(self.entries), size)
+            columns = numpy.where(generator.random(size) < probability[columns], columns, alias[columns])
+            amounts = generator.integers(low[columns], high[columns])
+            totals += numpy.bincount(columns, weights=amounts, minlength=len(self.entries)).astype(numpy.int64)
+        return totals.tolist()
+
+
+def roll(enemy_id: int, n: int=1, rng: random.Random=None, file: str=ENEMY_FILE,
+         file_format: str=DATA_FORMAT) -> List[Tuple[int, int]]:
+    """ Rolls the drops of n kills of an enemy; see LootTable.roll() """
+    return LootTable.get(enemy_id, file, file_format).roll(n, rng)
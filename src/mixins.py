@@ -3,37 +3,553 @@
 """ Collection of mixins for additional functionality """
 
 # Built-in libraries
+import os
 import math
 import json
+import time
+import marshal
+import threading
 
+from bisect import bisect_right
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Dict, Union, Any, NewType
-from copy import deepcopy
+from typing import List, Dict, Union, Any, Iterable, NewType, Tuple
 from functools import lru_cache
 from abc import ABCMeta, abstractmethod
 
 # 3rd-party libraries
-import toml
+# toml and (the optional) NumPy are imported on first use, as they are slow to import
 
 # Local libraries
-from settings import *
+from settings import (DATA_FORMAT, DATA_FILES, DATA_PACK_FILE, DATA_CACHE_SIZE, DATA_CACHE_POLICY,
+                      DATA_CHECK_INTERVAL, IMG_DIR, ITEM_FILE, ENTITY_FILE, ENEMY_FILE, NPC_FILE)
+from datapack import DataPack, file_digest
+from dataindex import DataIndex
+
+__all__ = [
+    'RecordCache',
+    'LRUCache',
+    'LFUCache',
+    'CACHE_POLICIES',
+    'make_cache',
+    'DataCatalog',
+    'CATALOG',
+    'preload',
+    'DataFileMixin',
+    'ReprMixin',
+    'StateMixin',
+    'EXP_TABLE_LIMIT',
+    'exp_thresholds',
+    'LevelMixin',
+    'SpriteRegistry',
+    'SPRITES',
+    'SpritesMixin',
+]
+
+
+@lru_cache(maxsize=None)
+def _numpy():
+    """ Returns the numpy module, or None if it isn't installed """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
 
 
-class DataFileMixin(metaclass=ABCMeta):
-    """ Contains methods for getting game data from files """
+class RecordCache(metaclass=ABCMeta):
+    """
+    Bounded cache of decoded game data records, keyed by (file, section, ID)
+
+    Subclasses decide which record to forget when the cache is full. A
+    maxsize of None makes the cache unbounded, 0 disables it. Lookups reorder
+    the cache, so get(), put() and invalidate() hold a lock: the catalog's
+    cache is shared by every thread.
+    """
+
+    def __init__(self, maxsize: Union[int, None]=DATA_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    @abstractmethod
+    def _lookup(self, key: tuple) -> Any:
+        """ Returns the cached record, or None """
+
+    @abstractmethod
+    def _store(self, key: tuple, record: Any) -> None:
+        """ Adds a record that isn't cached yet """
+
+    @abstractmethod
+    def _evict(self) -> None:
+        """ Forgets one record """
+
+    @abstractmethod
+    def _discard(self, key: tuple) -> None:
+        """ Forgets a specific record """
+
+    @abstractmethod
+    def keys(self) -> List[tuple]:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def __contains__(self, key: tuple) -> bool:
+        pass
+
+    def get(self, key: tuple) -> Any:
+        """ Returns the cached record, or None; counts as a hit or a miss """
+        with self._lock:
+            record = self._lookup(key)
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return record
+
+    def put(self, key: tuple, record: Any) -> None:
+        with self._lock:
+            if self.maxsize == 0 or key in self:
+                return
+            if self.maxsize is not None:
+                while len(self) >= self.maxsize:
+                    self._evict()
+                    self.evictions += 1
+            self._store(key, record)
+
+    def invalidate(self, file: str=None, section: str=None) -> None:
+        """ Forgets the records of a file, or of one of its sections, or everything """
+        with self._lock:
+            for key in self.keys():
+                if (file is None or key[0] == file) and (section is None or key[1] == section):
+                    self._discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """ Returns the cache's counters as plain data """
+        lookups = self.hits + self.misses
+        return {
+            'policy': type(self).__name__,
+            'size': len(self),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+
+class LRUCache(RecordCache):
+    """ Forgets the least recently used record first """
+
+    def __init__(self, maxsize: Union[int, None]=DATA_CACHE_SIZE) -> None:
+        super().__init__(maxsize)
+        self._records: OrderedDict = OrderedDict()
+
+    def _lookup(self, key: tuple) -> Any:
+        record = self._records.get(key)
+        if record is not None:
+            self._records.move_to_end(key)
+        return record
+
+    def get(self, key: tuple) -> Any:
+        # Inlined RecordCache.get(), as this is on the path of every record lookup
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._records.move_to_end(key)
+            return record
+
+    def _store(self, key: tuple, record: Any) -> None:
+        self._records[key] = record
+
+    def _evict(self) -> None:
+        self._records.popitem(last=False)
+
+    def _discard(self, key: tuple) -> None:
+        self._records.pop(key, None)
+
+    def keys(self) -> List[tuple]:
+        return list(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._records
+
+
+class LFUCache(RecordCache):
+    """
+    Forgets the least frequently used record first
+
+    Records used equally often are forgotten least recently used first.
+    Every operation takes constant time.
+    """
+
+    def __init__(self, maxsize: Union[int, None]=DATA_CACHE_SIZE) -> None:
+        super().__init__(maxsize)
+        # key -> [record, use count]
+        self._records: Dict[tuple, List] = {}
+        # use count -> keys used that many times, least recently used first
+        self._buckets: Dict[int, OrderedDict] = {}
+        self._min_count = 0
+
+    def _bump(self, key: tuple, entry: List) -> None:
+        count = entry[1]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._min_count == count:
+                self._min_count = count + 1
+        entry[1] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def _lookup(self, key: tuple) -> Any:
+        entry = self._records.get(key)
+        if entry is None:
+            return None
+        self._bump(key, entry)
+        return entry[0]
+
+    def _store(self, key: tuple, record: Any) -> None:
+        self._records[key] = [record, 1]
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+        self._min_count = 1
+
+    def _evict(self) -> None:
+        bucket = self._buckets[self._min_count]
+        key, _ = bucket.popitem(last=False)
+        if not bucket:
+            del self._buckets[self._min_count]
+        del self._records[key]
+        if not self._records:
+            self._min_count = 0
+        elif self._min_count not in self._buckets:
+            self._min_count = min(self._buckets)
+
+    def _discard(self, key: tuple) -> None:
+        entry = self._records.pop(key, None)
+        if entry is None:
+            return
+        bucket = self._buckets[entry[1]]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[entry[1]]
+            if self._min_count == entry[1]:
+                self._min_count = min(self._buckets) if self._buckets else 0
+
+    def keys(self) -> List[tuple]:
+        return list(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._records
+
+
+# Policy names usable as DATA_CACHE_POLICY
+CACHE_POLICIES = {
+    'lru': LRUCache,
+    'lfu': LFUCache,
+}
+
+
+def make_cache(maxsize: Union[int, None]=DATA_CACHE_SIZE, policy: str=DATA_CACHE_POLICY) -> RecordCache:
+    """ Creates a record cache with the named policy """
+    try:
+        return CACHE_POLICIES[policy.lower()](maxsize)
+    except KeyError:
+        raise ValueError(f"Unknown cache policy: {policy}") from None
+
+
+class DataCatalog:
+    """
+    Parses each game data file at most once and keeps its sections indexed by ID
+
+    If a data pack built from a file exists (see datapack.py), single objects
+    are read straight from the pack instead, as long as the file hasn't
+    changed since the pack was built. Failing that, single objects are read
+    through the file's sidecar index (see dataindex.py), if it is up to date.
+
+    Single objects are kept in a bounded record cache (see settings.py), so
+    repeated lookups are plain dictionary lookups. Files are checked for
+    changes (modification time and size) at most every check_interval
+    seconds, or on refresh(); a changed file is parsed again and its cached
+    records are forgotten.
+
+    Evicted records are read again as new objects, so objects built from a
+    record should compare generation(file) rather than record identity to
+    tell whether they are out of date.
+    """
+
+    def __init__(self, pack_file: str=DATA_PACK_FILE, cache: RecordCache=None,
+                 check_interval: Union[float, None]=DATA_CHECK_INTERVAL) -> None:
+        # file path -> ((mtime, size), {section: {ID: data}})
+        self._files: Dict[str, Any] = {}
+        self.pack_file = pack_file
+        self._pack: Union[DataPack, None] = None
+        self._pack_checked = False
+        # file path -> ((mtime, size), whether the pack is up to date with the file)
+        self._pack_verified: Dict[str, Any] = {}
+        # file path -> ((mtime, size), the file's sidecar index or None)
+        self._indexes: Dict[str, Any] = {}
+        # (event loop, file path) -> future of a load running in an executor
+        self._pending: Dict[tuple, Any] = {}
+        self.cache = make_cache() if cache is None else cache
+        self.check_interval = check_interval
+        self._next_check = 0.0
+        # file path -> number of times the file has been found changed or forgotten
+        self._generations: Dict[str, int] = {}
 
     @staticmethod
-    @lru_cache(maxsize=128, typed=True)
-    def _get_by_ID(ID: int, obj_type: str, file: str, file_format: str=DATA_FORMAT) -> Dict:
-        """ 'Low-level' access to filedata """
+    def _parse(file: str, file_format: str) -> Dict:
+        """ Reads and parses a whole data file """
         with open(file) as f:
             if file_format == "json":
-                data = json.load(f, parse_int=int, parse_float=float)
+                return json.load(f, parse_int=int, parse_float=float)
             elif file_format == "toml":
-                data = toml.load(f)
+                import toml
+                return toml.load(f)
+            raise NotImplementedError(f"Missing support for opening files of type: {file_format}")
+
+    @staticmethod
+    def _signature(file: str) -> Union[Tuple[int, int], None]:
+        """ Returns the modification time and size of a file, or None if it doesn't exist """
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def refresh(self, file: str=None) -> None:
+        """
+        Checks whether a data file, or every file read so far, has changed
+
+        Changed files are forgotten, along with their cached records, and are
+        read again on next use.
+        """
+        files = [file] if file is not None else set(self._files).union(self._pack_verified, self._indexes)
+        for file in files:
+            signature = self._signature(file)
+            changed = False
+            for known in (self._files, self._pack_verified, self._indexes):
+                cached = known.get(file)
+                if cached is not None and cached[0] != signature:
+                    # Another thread may have forgotten it already
+                    known.pop(file, None)
+                    changed = True
+            if changed:
+                self._forget_records(file)
+
+    def _forget_records(self, file: str) -> None:
+        """ Drops the cached records of a file whose data is out of date """
+        self.cache.invalidate(file)
+        self._generations[file] = self._generations.get(file, 0) + 1
+
+    def generation(self, file: str) -> int:
+        """ Returns a number that changes whenever the data of a file may have changed """
+        if self.check_interval is not None:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._check(now)
+        return self._generations.get(file, 0)
+
+    def _check(self, now: float) -> None:
+        """ Calls refresh() and schedules the next check """
+        self._next_check = now + self.check_interval
+        self.refresh()
+
+    def load(self, file: str, file_format: str=DATA_FORMAT) -> Dict:
+        """ Returns the sections of a data file, parsing it only if needed """
+        cached = self._files.get(file)
+        if cached is not None:
+            return cached[1]
+        signature = self._signature(file)
+        sections = {
+            section: {str(ID): value for ID, value in entries.items()}
+            if isinstance(entries, dict) else entries
+            for section, entries in self._parse(file, file_format).items()
+        }
+        self._files[file] = (signature, sections)
+        return sections
+
+    def _pack_for(self, file: str) -> Union[DataPack, None]:
+        """ Returns the data pack if it holds up-to-date data of the given file """
+        if not self._pack_checked:
+            self._pack_checked = True
+            if self.pack_file is not None and os.path.exists(self.pack_file):
+                self._pack = DataPack(self.pack_file)
+        if self._pack is None or not self._pack.covers(file):
+            return None
+        verified = self._pack_verified.get(file)
+        if verified is None:
+            signature = self._signature(file)
+            # Without the source file, only the pack was shipped
+            up_to_date = signature is None or file_digest(file) == self._pack.digest(file)
+            verified = self._pack_verified[file] = (signature, up_to_date)
+        return self._pack if verified[1] else None
+
+    def _index_for(self, file: str) -> Union[DataIndex, None]:
+        """ Returns the sidecar index of a data file that hasn't been parsed, if the index is up to date """
+        if file in self._files:
+            return None
+        cached = self._indexes.get(file)
+        if cached is None:
+            signature = self._signature(file)
+            if signature is None:
+                return None
+            cached = self._indexes[file] = (signature, DataIndex.open(file, signature))
+        return cached[1]
+
+    def get(self, ID: int, obj_type: str, file: str, file_format: str=DATA_FORMAT) -> Dict:
+        """ Returns the data of a single object """
+        if self.check_interval is not None:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._check(now)
+        key = (file, obj_type, str(ID))
+        record = self.cache.get(key)
+        if record is None:
+            pack = self._pack_for(file)
+            if pack is not None:
+                record = pack.get(file, obj_type, ID)
             else:
-                raise NotImplementedError(f"Missing support for opening files of type: {file_format}")
-        return data[obj_type][str(ID)]
+                index = self._index_for(file)
+                if index is not None:
+                    record = index.get(obj_type, ID)
+                else:
+                    record = self.load(file, file_format)[obj_type][key[2]]
+            self.cache.put(key, record)
+        return record
+
+    def warm(self, IDs: Iterable[int], obj_type: str, file: str, file_format: str=DATA_FORMAT) -> int:
+        """
+        Loads the given objects into the record cache, eg. everything a zone needs
+
+        Returns how many of them were found; missing IDs are skipped.
+        """
+        found = 0
+        for ID in IDs:
+            try:
+                self.get(ID, obj_type, file, file_format)
+            except KeyError:
+                continue
+            found += 1
+        return found
+
+    def _warm(self, file: str, file_format: str=DATA_FORMAT) -> None:
+        """ Does the blocking part of a lookup: checks the data pack and the index, or parses the file """
+        if self._pack_for(file) is None and self._index_for(file) is None:
+            self.load(file, file_format)
+
+    async def awarm(self, file: str, file_format: str=DATA_FORMAT) -> None:
+        """
+        Makes a data file ready for lookups without blocking the event loop
+
+        The blocking work runs in the loop's default executor. Concurrent calls
+        for the same file share a single load.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        key = (loop, file)
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = loop.run_in_executor(None, self._warm, file, file_format)
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        await asyncio.shield(future)
+
+    async def aget(self, ID: int, obj_type: str, file: str, file_format: str=DATA_FORMAT) -> Dict:
+        """ Returns the data of a single object without blocking the event loop """
+        if file not in self._files and file not in self._pack_verified and file not in self._indexes:
+            await self.awarm(file, file_format)
+        return self.get(ID, obj_type, file, file_format)
+
+    def invalidate(self, file: str=None, section: str=None) -> None:
+        """
+        Forgets a parsed file, or every parsed file if none is given
+
+        Forgetting every file also reopens the data pack on next use. Given a
+        section, only the cached objects of that section of the file are
+        forgotten.
+        """
+        if section is not None:
+            self.cache.invalidate(file, section)
+            return
+        if file is None:
+            for known in set(self._files).union(self._pack_verified, self._indexes, self._generations):
+                self._forget_records(known)
+            self.cache.invalidate()
+            self._files.clear()
+            self._pack_verified.clear()
+            self._indexes.clear()
+            if self._pack is not None:
+                self._pack.close()
+                self._pack = None
+            self._pack_checked = False
+        else:
+            self._forget_records(file)
+            self._files.pop(file, None)
+            self._pack_verified.pop(file, None)
+            self._indexes.pop(file, None)
+
+    def __contains__(self, file: str) -> bool:
+        return file in self._files
+
+
+CATALOG = DataCatalog()
+
+
+def preload(files: Iterable[str]=None, background: bool=True) -> Union[threading.Thread, None]:
+    """
+    Warms the data catalog, so that the first lookups don't need to parse anything
+
+    By default every data file listed in settings.py that exists is loaded, in
+    a daemon thread which is returned. With background=False, the files are
+    loaded before returning.
+    """
+    if files is None:
+        files = [file for file in DATA_FILES if os.path.exists(file)]
+    files = list(files)
+
+    def warm():
+        for file in files:
+            CATALOG._warm(file)
+
+    if not background:
+        warm()
+        return None
+    thread = threading.Thread(target=warm, name="rpgenie-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+class DataFileMixin(metaclass=ABCMeta):
+    """ Contains methods for getting game data from files """
+
+    __slots__ = ()
+
+    @staticmethod
+    def _get_by_ID(ID: int, obj_type: str, file: str, file_format: str=DATA_FORMAT) -> Dict:
+        """ 'Low-level' access to filedata """
+        return CATALOG.get(ID, obj_type, file, file_format)
+
+    @staticmethod
+    async def _aget_by_ID(ID: int, obj_type: str, file: str, file_format: str=DATA_FORMAT) -> Dict:
+        """ 'Low-level' access to filedata that doesn't block the event loop """
+        return await CATALOG.aget(ID, obj_type, file, file_format)
 
     def get_item_by_ID(self, ID: int, file: str=ITEM_FILE) -> Dict:
         """ Returns a dictionary representation of a given item ID """
@@ -51,21 +567,126 @@ class DataFileMixin(metaclass=ABCMeta):
         """ Returns a dictionary representation of a given entity ID """
         return self._get_by_ID(ID, 'entities', file)
 
+    async def aget_item_by_ID(self, ID: int, file: str=ITEM_FILE) -> Dict:
+        """ Asynchronous version of get_item_by_ID() """
+        return await self._aget_by_ID(ID, 'items', file)
+
+    async def aget_enemy_by_ID(self, ID: int, file: str=ENEMY_FILE) -> Dict:
+        """ Asynchronous version of get_enemy_by_ID() """
+        return await self._aget_by_ID(ID, 'enemies', file)
+
+    async def aget_npc_by_ID(self, ID: int, file: str=NPC_FILE) -> Dict:
+        """ Asynchronous version of get_npc_by_ID() """
+        return await self._aget_by_ID(ID, 'NPCs', file)
+
+    async def aget_entity_by_ID(self, ID: int, file: str=ENTITY_FILE) -> Dict:
+        """ Asynchronous version of get_entity_by_ID() """
+        return await self._aget_by_ID(ID, 'entities', file)
+
 
 class ReprMixin(metaclass=ABCMeta):
     """ Automatically generates a __repr__-method for any class """
 
+    __slots__ = ()
+
+    def _repr_items(self):
+        """ Yields the instance attributes, including those stored in __slots__ """
+        yield from getattr(self, '__dict__', {}).items()
+        for cls in type(self).__mro__:
+            for key in cls.__dict__.get('__slots__', ()):
+                if key not in ('__dict__', '__weakref__') and hasattr(self, key):
+                    yield key, getattr(self, key)
+
     def __repr__(self):
         """ Automatically generated __repr__-method """
 
         attributes = [f"{key}={value}" if type(value) != str
                      else f'{key}="{value}"'
-                     for key, value in vars(self).items()]
+                     for key, value in self._repr_items()]
         v_string = ", ".join(attributes)
         class_name = self.__class__.__name__
         return f"{class_name}({v_string})"
 
 
+class StateMixin(metaclass=ABCMeta):
+    """
+    Gives the child class a compact binary encoding of its state
+
+    The child class provides to_state(), which returns its state as plain data
+    (dicts, lists, strings and numbers), and from_state(), which rebuilds an
+    object from that data. The binary encoding is a version byte followed by
+    the state in marshal format; only load data you have saved yourself.
+    """
+
+    __slots__ = ()
+
+    STATE_VERSION = 1
+
+    @abstractmethod
+    def to_state(self) -> Any:
+        """ Returns the object's state as plain data """
+
+    @classmethod
+    @abstractmethod
+    def from_state(cls, state: Any) -> Any:
+        """ Creates an object from the output of to_state() """
+
+    def to_bytes(self) -> bytes:
+        """ Returns the object's state in binary form """
+        return bytes((self.STATE_VERSION,)) + marshal.dumps(self.to_state(), 4)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Any:
+        """ Creates an object from the output of to_bytes() """
+        if not data or data[0] != cls.STATE_VERSION:
+            raise ValueError(f"Unsupported state version; expected {cls.STATE_VERSION}")
+        return cls.from_state(marshal.loads(data[1:]))
+
+
+# EXP threshold tables are built for at most this many levels
+EXP_TABLE_LIMIT = 2**16
+
+
+@lru_cache(maxsize=None)
+def exp_thresholds(base_exp: int, exponent: float, levels: int) -> Tuple[int, ...]:
+    """
+    Returns the EXP needed to leave each level from 1 up to (but not including) the given level
+
+    The thresholds are computed exactly like LevelMixin.next_level.
+    """
+    return tuple(math.floor(base_exp * (level**exponent)) for level in range(1, levels))
+
+
+def _thresholds_for(base_exp: int, exponent: float, max_level: Union[int, None], exp: int) -> Union[Tuple[int, ...], None]:
+    """
+    Returns a threshold table long enough to cover the given amount of EXP
+
+    Returns None if the table would need more than EXP_TABLE_LIMIT levels.
+    """
+    if max_level is not None and max_level <= EXP_TABLE_LIMIT:
+        return exp_thresholds(base_exp, exponent, max_level)
+    levels = 64
+    table = exp_thresholds(base_exp, exponent, levels)
+    while table[-1] <= exp:
+        if levels >= EXP_TABLE_LIMIT:
+            return None
+        levels *= 2
+        table = exp_thresholds(base_exp, exponent, levels)
+    return table
+
+
+def _levels_passed(base_exp: int, exponent: float, exp: int) -> int:
+    """ Returns how many levels have a threshold of at most the given EXP, in closed form """
+    # floor(base_exp * level**exponent) <= exp  <=>  level < ((exp+1) / base_exp) ** (1/exponent)
+    level = int(((exp + 1) / base_exp) ** (1 / exponent))
+    # Correct for floating point error around the boundary
+    while level > 0 and math.floor(base_exp * (level**exponent)) > exp:
+        level -= 1
+    while math.floor(base_exp * ((level+1)**exponent)) <= exp:
+        level += 1
+    return level
+
+
 class LevelMixin(metaclass=ABCMeta):
     """ Gives standard level-up mechanics for the child class """
     def __init__(self, **kwargs):
@@ -86,6 +707,25 @@ class LevelMixin(metaclass=ABCMeta):
         self._base_exp: int = int(kwargs.get("base_exp", 85))
         self.max_level: Union[int, None] = kwargs.get("max_level", None)
 
+    @staticmethod
+    def level_for_exp(exp: int, level: int=1, max_level: int=None,
+                      base_exp: int=85, exponent: float=1.6) -> int:
+        """
+        Returns the level reached with the given EXP, starting from the given level
+
+        Looks the level up from a cached threshold table with a binary search
+        instead of checking one level at a time. Very long EXP curves are
+        solved in closed form instead.
+        """
+        table = _thresholds_for(base_exp, exponent, max_level, exp)
+        if table is None:
+            new_level = _levels_passed(base_exp, exponent, exp) + 1
+        else:
+            new_level = bisect_right(table, exp) + 1
+        if max_level is not None:
+            new_level = min(new_level, max_level)
+        return max(level, new_level)
+
     @property
     def next_level(self) -> int:
         """
@@ -114,17 +754,14 @@ class LevelMixin(metaclass=ABCMeta):
         """
 
         results = []
-        gained_levels = 0
-
-        while self.next_level <= self.experience:
-            if self.level == self.max_level:
-                break
-
-            if self.max_level is None or self.level < self.max_level:
-                self.level += 1
-                gained_levels += 1
-                if print_exp is not None:
-                    print_exp = True
+        new_level = self.level_for_exp(self.experience, self.level, self.max_level,
+                                       self._base_exp, self.exponent)
+        gained_levels = new_level - self.level
+        self.level = new_level
+        if gained_levels:
+            self._level_changed()
+            if print_exp is not None:
+                print_exp = True
 
         if gained_levels == 1:
             results.append(f"Congratulations! You've levelled up; your new level is {self.level}")
@@ -140,6 +777,9 @@ class LevelMixin(metaclass=ABCMeta):
         formatted_results = "\n".join(results)
         return formatted_results
 
+    def _level_changed(self) -> None:
+        """ Called whenever levelling up changes the level; does nothing unless overridden """
+
     def give_exp(self, amount: int, check_level_up=True, print_exp=False) -> Union[str, None]:
         """
         Give the object experience points.
@@ -151,6 +791,110 @@ class LevelMixin(metaclass=ABCMeta):
             return self.level_up(print_exp)
         return None
 
+    @staticmethod
+    def give_exp_many(characters: Iterable['LevelMixin'], amounts: Iterable[int]) -> List[int]:
+        """
+        Gives EXP to many objects at once and levels them up, without printing anything.
+
+        Objects sharing an EXP curve are levelled up together; with NumPy
+        installed, each group is handled with a single vectorised search.
+        Returns the number of levels each object gained.
+        """
+        characters = list(characters)
+        amounts = list(amounts)
+        if len(characters) != len(amounts):
+            raise ValueError("Every character needs exactly one EXP amount")
+
+        groups: Dict[tuple, List[int]] = {}
+        for i, (character, amount) in enumerate(zip(characters, amounts)):
+            character.experience += amount
+            curve = (character._base_exp, character.exponent, character.max_level)
+            groups.setdefault(curve, []).append(i)
+
+        gained = [0] * len(characters)
+        for (base_exp, exponent, max_level), indices in groups.items():
+            exps = [characters[i].experience for i in indices]
+            table = _thresholds_for(base_exp, exponent, max_level, max(exps))
+            if table is None:
+                new_levels = [_levels_passed(base_exp, exponent, exp) + 1 for exp in exps]
+            elif _numpy() is not None:
+                new_levels = (_numpy().searchsorted(table, exps, side='right') + 1).tolist()
+            else:
+                new_levels = [bisect_right(table, exp) + 1 for exp in exps]
+            for i, new_level in zip(indices, new_levels):
+                character = characters[i]
+                if max_level is not None:
+                    new_level = min(new_level, max_level)
+                new_level = max(character.level, new_level)
+                gained[i] = new_level - character.level
+                if gained[i]:
+                    character.level = new_level
+                    character._level_changed()
+        return gained
+
+class SpriteRegistry:
+    """
+    Caches the sprite files of every game object
+
+    An object's sprites are scanned again only if the modification time of
+    its directory, or of any directory below it, has changed since the last
+    scan.
+    """
+
+    def __init__(self, root: Path=IMG_DIR) -> None:
+        self.root = Path(root)
+        # (type, name) -> (scanned directories, their mtimes, sprites)
+        self._sprites: Dict[Tuple[str, str], Any] = {}
+
+    def _mtime(self, path: Path) -> Union[int, None]:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self, type: str, obj: str) -> List: #TODO: Fill in the sprite object type
+        """ Returns the sprite files of a single game object """
+        cached = self._sprites.get((type, obj))
+        if cached is None or [self._mtime(directory) for directory in cached[0]] != cached[1]:
+            path = self.root / type / obj
+            sprites = self._scan(path)
+            # Files added to a subdirectory only change the subdirectory's mtime
+            directories = [path] + [Path(sprite) for sprite in sprites if os.path.isdir(sprite)]
+            cached = self._sprites[(type, obj)] = (directories,
+                                                   [self._mtime(directory) for directory in directories],
+                                                   sprites)
+        return list(cached[2])
+
+    @staticmethod
+    def _scan(path: Path) -> List:
+        """ Lists every sprite file under a directory """
+        #TODO: Implement file loading as file objects
+        return [str(sprite) for sprite in path.resolve().glob('**/*')]
+
+    def scan(self, type: str=None) -> None:
+        """ Scans the sprites of every object, or every object of the given type, in one go """
+        types = [self.root / type] if type is not None else self.root.iterdir()
+        for type_dir in types:
+            if not type_dir.is_dir():
+                continue
+            for obj_dir in type_dir.iterdir():
+                if obj_dir.is_dir():
+                    self.get(type_dir.name, obj_dir.name)
+
+    def invalidate(self, type: str=None, obj: str=None) -> None:
+        """ Forgets cached sprites; all of them, those of a type, or those of a single object """
+        if type is None:
+            self._sprites.clear()
+        elif obj is None:
+            for key in [key for key in self._sprites if key[0] == type]:
+                del self._sprites[key]
+        else:
+            self._sprites.pop((type, obj), None)
+
+
+SPRITES = SpriteRegistry()
+
+
 class SpritesMixin(metaclass=ABCMeta):
     """
     Contains methods for loading sprites for game objects
@@ -159,13 +903,8 @@ class SpritesMixin(metaclass=ABCMeta):
     """
 
     @staticmethod
-    def __load_sprites(type: str, obj: str) -> List: #TODO: Fill in the sprite object type
-        path = Path(__file__).parent / "img" / type / obj
-        sprites = []
-        for sprite in path.resolve().glob('**/*'):
-            #TODO: Implement file loading as file objects
-            sprites.append(str(sprite))
-        return sprites
+    def __load_sprites(type: str, obj: str) -> List:
+        return SPRITES.get(type, obj)
 
     def load_char_sprites(self, name: str):
         return self.__load_sprites('chars', name.lower())
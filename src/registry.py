@@ -0,0 +1,190 @@
+#! python3
+
+"""
+World registry of characters, with indexes for common queries
+
+Characters register themselves with WORLD when they are created (pass
+registry=None to opt out). The registry only holds weak references, so a
+character leaves it when it is garbage collected. Besides name lookup it
+keeps two secondary indexes up to date as the game runs:
+- level buckets, updated when EXP is given through LevelMixin.give_exp()
+  or give_exp_many(); after setting a level directly, call update()
+- item ID -> holders, updated by the character's inventory whenever an item
+  ID appears in or disappears from its slots or gear
+
+The registry has its own lock, so characters whose inventories are shared
+between threads (thread_safe=True) can update it from any of them. Bulk
+simulations that never query the registry should pass registry=None, as
+keeping the indexes up to date isn't free.
+"""
+
+# Built-in libraries
+import weakref
+
+from threading import RLock
+from bisect import bisect_left, insort
+from functools import partial
+from typing import List, Dict, Any, Iterator
+
+# 3rd-party libraries
+# None
+
+# Local libraries
+# None
+
+__all__ = [
+    'EntityRegistry',
+    'WORLD',
+]
+
+
+class EntityRegistry:
+    """ Weakly referenced characters, indexed by name, level and held item IDs """
+
+    def __init__(self) -> None:
+        # id(character) -> [weak reference, indexed name, indexed level, held item IDs]
+        self._entries: Dict[int, List] = {}
+        # index key -> {id(character): weak reference}
+        self._names: Dict[str, Dict[int, Any]] = {}
+        self._levels: Dict[int, Dict[int, Any]] = {}
+        self._holders: Dict[int, Dict[int, Any]] = {}
+        # Every level with a non-empty bucket, sorted for range queries
+        self._level_keys: List[int] = []
+        # Reentrant, as garbage collection can run _collected() while the lock is held.
+        # Inventories call in while holding their own lock, so never call into an
+        # inventory while holding this one
+        self._lock = RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, character: Any) -> bool:
+        return id(character) in self._entries
+
+    def __iter__(self) -> Iterator:
+        with self._lock:
+            refs = [entry[0] for entry in self._entries.values()]
+        return self._live(refs)
+
+    @staticmethod
+    def _live(refs) -> Iterator:
+        for ref in refs:
+            character = ref()
+            if character is not None:
+                yield character
+
+    def _add(self, index: Dict, key: Any, key_id: int, ref: Any) -> None:
+        bucket = index.get(key)
+        if bucket is None:
+            bucket = index[key] = {}
+            if index is self._levels:
+                insort(self._level_keys, key)
+        bucket[key_id] = ref
+
+    def _discard(self, index: Dict, key: Any, key_id: int) -> None:
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        bucket.pop(key_id, None)
+        if not bucket:
+            del index[key]
+            if index is self._levels:
+                del self._level_keys[bisect_left(self._level_keys, key)]
+
+    def register(self, character: Any) -> None:
+        """ Starts tracking a character """
+        key_id = id(character)
+        with self._lock:
+            if key_id in self._entries:
+                return
+            ref = weakref.ref(character, partial(self._collected, key_id))
+            self._entries[key_id] = [ref, character.name, character.level, set()]
+            self._add(self._names, character.name, key_id, ref)
+            self._add(self._levels, character.level, key_id, ref)
+            character._registry = self
+        character.inventory._watch(partial(self._holding_changed, key_id))
+
+    def unregister(self, character: Any) -> None:
+        """ Stops tracking a character """
+        if id(character) in self._entries:
+            character.inventory._watch(None)
+            character._registry = None
+            self._collected(id(character))
+
+    def _collected(self, key_id: int, ref: Any=None) -> None:
+        with self._lock:
+            entry = self._entries.pop(key_id, None)
+            if entry is None:
+                return
+            _, name, level, held = entry
+            self._discard(self._names, name, key_id)
+            self._discard(self._levels, level, key_id)
+            for ID in held:
+                self._discard(self._holders, ID, key_id)
+
+    def update(self, character: Any) -> None:
+        """ Re-indexes a character whose name, level or inventory was replaced directly """
+        self.unregister(character)
+        self.register(character)
+
+    def _renamed(self, character: Any) -> None:
+        with self._lock:
+            entry = self._entries.get(id(character))
+            if entry is not None and entry[1] != character.name:
+                self._discard(self._names, entry[1], id(character))
+                entry[1] = character.name
+                self._add(self._names, entry[1], id(character), entry[0])
+
+    def _level_changed(self, character: Any) -> None:
+        with self._lock:
+            entry = self._entries.get(id(character))
+            if entry is not None and entry[2] != character.level:
+                self._discard(self._levels, entry[2], id(character))
+                entry[2] = character.level
+                self._add(self._levels, entry[2], id(character), entry[0])
+
+    def _holding_changed(self, key_id: int, ID: int, present: bool) -> None:
+        with self._lock:
+            entry = self._entries.get(key_id)
+            if entry is None:
+                return
+            if present:
+                entry[3].add(ID)
+                self._add(self._holders, ID, key_id, entry[0])
+            else:
+                entry[3].discard(ID)
+                self._discard(self._holders, ID, key_id)
+
+    # Queries
+
+    def _query(self, index: Dict, key: Any) -> List:
+        with self._lock:
+            refs = list(index.get(key, {}).values())
+        return list(self._live(refs))
+
+    def named(self, name: str) -> List:
+        """ Returns the characters with the given name """
+        return self._query(self._names, name)
+
+    def at_level(self, level: int) -> List:
+        """ Returns the characters at exactly the given level """
+        return self._query(self._levels, level)
+
+    def in_level_range(self, low: int=None, high: int=None) -> List:
+        """ Returns the characters with low <= level <= high; either bound can be left out """
+        refs = []
+        with self._lock:
+            keys = self._level_keys
+            start = 0 if low is None else bisect_left(keys, low)
+            for level in keys[start:]:
+                if high is not None and level > high:
+                    break
+                refs.extend(self._levels[level].values())
+        return list(self._live(refs))
+
+    def holding(self, ID: int) -> List:
+        """ Returns the characters carrying or wearing at least one item of the given ID """
+        return self._query(self._holders, ID)
+
+
+WORLD = EntityRegistry()
@@ -1,8 +1,30 @@
 from pathlib import Path
 
+__all__ = [
+    'DATA_DIR',
+    'IMG_DIR',
+    'DATA_FORMAT',
+    'ITEM_MAX_COUNT',
+    'JOURNAL_LIMIT',
+    'ITEM_FILE',
+    'ENTITY_FILE',
+    'ENEMY_FILE',
+    'NPC_FILE',
+    'QUEST_FILE',
+    'OBJECT_FILE',
+    'DATA_FILES',
+    'DATA_PACK_FILE',
+    'DATA_INDEX_SUFFIX',
+    'DATA_CACHE_SIZE',
+    'DATA_CACHE_POLICY',
+    'DATA_CHECK_INTERVAL',
+]
+
 DATA_DIR = Path(__file__).parent / "data"
+IMG_DIR = Path(__file__).parent / "img"
 DATA_FORMAT = "json"
 ITEM_MAX_COUNT = 10**5 #Used to change item description
+JOURNAL_LIMIT = 1024 #Number of changes a container remembers for delta syncing; 0 turns journals off
 
 ITEM_FILE = str(DATA_DIR / f"items.{DATA_FORMAT}")
 ENTITY_FILE = str(DATA_DIR / f"entities.{DATA_FORMAT}")
@@ -10,3 +32,20 @@ ENEMY_FILE = str(DATA_DIR / f"enemies.{DATA_FORMAT}")
 NPC_FILE = str(DATA_DIR / f"npcs.{DATA_FORMAT}")
 QUEST_FILE = str(DATA_DIR / f"quests.{DATA_FORMAT}")
 OBJECT_FILE = str(DATA_DIR / f"objects.{DATA_FORMAT}")
+DATA_FILES = (ITEM_FILE, ENTITY_FILE, ENEMY_FILE, NPC_FILE, QUEST_FILE, OBJECT_FILE)
+
+# Precompiled data pack, built from the files above with datapack.py
+DATA_PACK_FILE = str(DATA_DIR / "data.pack")
+
+# Sidecar record indexes written by dataindex.py are named after their data file plus this suffix
+DATA_INDEX_SUFFIX = ".idx"
+
+# Number of game data records DataCatalog keeps decoded, and how it picks
+# which to forget when full: "lru" (least recently used) or "lfu" (least
+# frequently used). A size of None never forgets anything.
+DATA_CACHE_SIZE = 4096
+DATA_CACHE_POLICY = "lru"
+
+# Seconds between DataCatalog's checks for changed data files. Lookups in
+# between don't touch the disk; None only checks on DataCatalog.refresh().
+DATA_CHECK_INTERVAL = 1.0
@@ -0,0 +1,146 @@
+#! python3
+
+"""
+Offline world simulation of enemy populations, for balancing
+
+run_simulation() creates a population of enemies from the enemy data file,
+lets them gain EXP and drop loot into their inventories for a number of
+ticks, and returns aggregate statistics. The population is split into
+batches that run in a process pool; on platforms that can fork, the data
+catalog is loaded once in the parent process and shared with the workers
+instead of being reloaded by each of them.
+"""
+
+# Built-in libraries
+import random
+import multiprocessing
+
+from typing import Dict, Sequence, Tuple
+
+# 3rd-party libraries
+# None
+
+# Local libraries
+from settings import ENEMY_FILE, ITEM_FILE
+from mixins import CATALOG, LevelMixin, ReprMixin
+from classes import Item, ItemDefinition, Character
+
+__all__ = [
+    'SimulationStats',
+    'run_simulation',
+]
+
+
+class SimulationStats(ReprMixin):
+    """ Aggregate results of a simulation; results of separate batches can be merged """
+
+    def __init__(self) -> None:
+        self.characters = 0
+        self.experience = 0
+        self.levels_gained = 0
+        # level -> number of characters at that level at the end
+        self.levels: Dict[int, int] = {}
+        # item ID -> number of items dropped
+        self.drops: Dict[int, int] = {}
+        # drops that didn't fit in an inventory
+        self.lost_drops = 0
+
+    def merge(self, other: 'SimulationStats') -> 'SimulationStats':
+        """ Adds another set of results to this one """
+        self.characters += other.characters
+        self.experience += other.experience
+        self.levels_gained += other.levels_gained
+        for level, count in other.levels.items():
+            self.levels[level] = self.levels.get(level, 0) + count
+        for ID, count in other.drops.items():
+            self.drops[ID] = self.drops.get(ID, 0) + count
+        self.lost_drops += other.lost_drops
+        return self
+
+
+def _simulate_batch(task: Tuple) -> SimulationStats:
+    """ Simulates characters start..stop of the population; runs in a worker process """
+    start, stop, config = task
+    enemy_ids, ticks, exp_range, loot, force_level_up, seed, enemy_file, item_file = config
+    rng = random.Random(seed * 1000003 + start)
+    stats = SimulationStats()
+
+    characters = []
+    levelling = []
+    for index in range(start, stop):
+        enemy_id = enemy_ids[index % len(enemy_ids)]
+        enemy_data = CATALOG.get(enemy_id, 'enemies', enemy_file)
+        # The simulated characters are never looked up, so keep them out of the world registry
+        character = Character(f"{enemy_data['name']} #{index}", level=enemy_data.get('level', 1), registry=None)
+        characters.append(character)
+        if force_level_up or enemy_data.get('canLevelUp', False):
+            levelling.append(character)
+
+    definitions = [(ItemDefinition.get(ID, item_file), chance) for ID, chance in loot]
+    low, high = exp_range
+    for _ in range(ticks):
+        amounts = [rng.randint(low, high) for _ in levelling]
+        stats.experience += sum(amounts)
+        stats.levels_gained += sum(LevelMixin.give_exp_many(levelling, amounts))
+
+        for character in characters:
+            dropped = [Item.from_definition(definition) for definition, chance in definitions
+                       if rng.random() < chance]
+            if not dropped:
+                continue
+            if character.inventory.add_many(dropped).success:
+                for item in dropped:
+                    stats.drops[item.ID] = stats.drops.get(item.ID, 0) + 1
+            else:
+                stats.lost_drops += len(dropped)
+
+    stats.characters = len(characters)
+    for character in characters:
+        stats.levels[character.level] = stats.levels.get(character.level, 0) + 1
+    return stats
+
+
+def run_simulation(population: int, enemy_ids: Sequence[int], ticks: int=10,
+                   exp_range: Tuple[int, int]=(1, 100), loot: Sequence[Tuple[int, float]]=(),
+                   processes: int=None, batch_size: int=10000, seed: int=0,
+                   force_level_up: bool=False, enemy_file: str=ENEMY_FILE,
+                   item_file: str=ITEM_FILE) -> SimulationStats:
+    """
+    Simulates a population of enemies and returns the merged statistics
+
+    Arguments:
+    - population: number of enemies to simulate
+    - enemy_ids: enemy IDs the population is made of, in equal shares
+    - ticks: number of rounds to simulate
+    - exp_range: every round, each enemy gains a random amount of EXP in this range;
+                 only enemies with canLevelUp set gain EXP, unless force_level_up is True
+    - loot: (item ID, drop chance) pairs rolled for every enemy every round
+    - processes: size of the process pool; defaults to the number of CPUs, 1 runs in this process
+    - batch_size: number of enemies a worker simulates at a time
+    - seed: seed for the random rolls; the same seed gives the same results
+    """
+    # Load everything the workers need before they start, so that forked
+    # workers share the parsed data instead of parsing it again
+    for enemy_id in set(enemy_ids):
+        CATALOG.get(enemy_id, 'enemies', enemy_file)
+    for ID, _ in loot:
+        ItemDefinition.get(ID, item_file)
+
+    config = (list(enemy_ids), ticks, exp_range, list(loot), force_level_up, seed, enemy_file, item_file)
+    tasks = [(start, min(start + batch_size, population), config)
+             for start in range(0, population, batch_size)]
+
+    stats = SimulationStats()
+    if processes == 1:
+        for task in tasks:
+            stats.merge(_simulate_batch(task))
+        return stats
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    with context.Pool(processes) as pool:
+        for batch_stats in pool.imap_unordered(_simulate_batch, tasks):
+            stats.merge(batch_stats)
+    return stats
@@ -3,9 +3,13 @@
 """ Pytest-compatible tests for src/classes.py """
 
 import sys
+import pickle
+import asyncio
+import subprocess
+import threading
 
-from pathlib import Path
 from copy import deepcopy
+from pathlib import Path
 from unittest import mock
 
 # A workaround for tests not automatically setting
@@ -13,7 +17,8 @@ from unittest import mock
 path_to_src = Path(__file__).parent.parent / "src"
 sys.path.insert(0, str(path_to_src))
 
-from classes import Item, Inventory, Player, Character
+from classes import Item, ItemDefinition, ItemMultiset, Recipe, RecipeIndex, Container, CompactContainer, GearLayout, Inventory, Player, Character, NO_LOCK
+from mixins import CATALOG
 from settings import *
 
 
@@ -21,7 +26,7 @@ def initialiser(testcase):
     """ Initialises all test cases with data """
     def inner(*args, **kwargs):
         items = [Item(i) for i in range(kwargs.get("itemcount", 3))]
-        inv = Inventory(items=deepcopy(items), **kwargs)
+        inv = Inventory(items=[Item.from_definition(item.definition) for item in items], **kwargs)
         return testcase(items, inv, *args, **kwargs)
     return inner
 
@@ -30,6 +35,76 @@ def test_testData(items, inv, *args, **kwargs):
     """ Assert the test data itself is valid """
     assert items == inv.items
 
+def test_import_is_lazy():
+    """ Importing the classes doesn't pull in slow, rarely needed modules """
+    code = "import sys, classes; print(sorted(m for m in ('toml', 'numpy', 'asyncio') if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=str(path_to_src),
+                            stdout=subprocess.PIPE, check=True).stdout
+    assert output.decode().strip() == "[]"
+
+def test_item_definition_shared():
+    """ Items of the same ID share one immutable definition """
+    first, second = Item(1), Item(1, meta="engraved")
+    assert first.definition is second.definition
+    assert first.attack == 5 and first.name == second.name
+    assert first != second
+    assert not hasattr(first, '__dict__')
+    try:
+        first.definition.name = "Iron sword"
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("ItemDefinition should be immutable")
+
+    # Unpickled items share the definition too
+    copy = pickle.loads(pickle.dumps(second))
+    assert copy == second and copy.definition is first.definition
+
+    # Records dropped from the record cache don't rebuild the definition; a changed file does
+    CATALOG.cache.invalidate()
+    assert Item(1).definition is first.definition
+    CATALOG.invalidate(ITEM_FILE)
+    assert Item(1).definition is not first.definition and Item(1) == first
+
+def test_item_acreate():
+    """ Items created asynchronously match synchronously created ones """
+    loop = asyncio.new_event_loop()
+    try:
+        item = loop.run_until_complete(Item.acreate(0, count=5, meta='gold'))
+    finally:
+        loop.close()
+    assert item == Item(0, meta='gold')
+    assert item._count == 5
+
+def test_item_hash_multiset():
+    """ Items work as set members and dict keys, and multisets compare contents """
+    assert len({Item(2), Item(2), Item(2, meta={'a': [1]}), Item(2, meta={'a': [1]})}) == 2
+    assert hash(Item(0, count=3)) == hash(Item(0))
+
+    # Metadata stacks exactly when it compares equal
+    bank = Container(items=[Item(0, meta=[1])])
+    bank.append(Item(0, meta=(1,)))
+    bank.append(Item(0, meta={1, 2}))
+    bank.append(Item(0, meta=frozenset({1, 2})))
+    assert [item.metadata for item in bank.items] == [[1], (1,), {1, 2}]
+    assert Item(0, meta={'a': 1}) != Item(0, meta={('a', 1)}) and Item(0, meta={('a', 1)}) not in bank
+    try:
+        bank.append(Item(0, meta=bytearray(b'x')))
+    except TypeError as e:
+        assert "bytearray" in str(e)
+    else:
+        raise AssertionError("Unhashable metadata should be rejected")
+
+    bank = Container(items=[Item(0, count=30), Item(2), Item(2), Item(1, meta='rusty')])
+    required = ItemMultiset.from_items([Item(0, count=20), Item(2)])
+    assert required.issubset(bank.to_multiset())
+    assert not (required + required).issubset(bank.to_multiset())
+
+    missing = required + required - bank.to_multiset()
+    assert isinstance(missing, ItemMultiset)
+    assert missing == ItemMultiset({Item(0): 10})
+    assert missing.to_items()[0]._count == 10
+
 @initialiser
 def test_inv_append(items, inv, *args, **kwargs):
     """ Test for inventory append functionality """
@@ -46,7 +121,9 @@ def test_inv_append(items, inv, *args, **kwargs):
 @initialiser
 def test_inv_remove(items, inv, *args, **kwargs):
     """ Test for inventory item removal """
-    inv.items[inv.items.index(Item(0))]._count += 2
+    inv.mark_clean()
+    inv.set_count(Item(0), inv.items[inv.items.index(Item(0))]._count + 2)
+    assert inv.dirty and [0, 3, None] in inv.to_state()['items']
 
     # Non-stackable items
     assert inv.remove(Item(1)) == f"{Item(1).name} was successfully removed"
@@ -59,6 +136,235 @@ def test_inv_remove(items, inv, *args, **kwargs):
     assert inv.remove(Item(0), count=2) == f"{Item(0).name} was successfully removed"
     assert inv.items.count(Item(0)) == 0
 
+def test_container_index():
+    """ Stack lookups stay consistent with the slot order """
+    cont = Container(max_capacity=5)
+    cont.append(Item(2))
+    cont.append(Item(0, meta={'minted': [1999]}))
+    cont.append(Item(2))
+    cont.append(Item(0, meta={'minted': [1999]}, count=4))
+    assert len(cont) == 3
+    assert cont.items[1]._count == 5
+    assert Item(0, meta={'minted': [1999]}) in cont
+    assert Item(0) not in cont
+
+    cont.remove(Item(2))
+    assert [item.ID for item in cont.items] == [0, 2]
+    cont.remove(Item(2))
+    assert Item(2) not in cont
+    cont.append(Item(1))
+    assert [item.ID for item in cont.items] == [0, 1]
+
+    # The returned list is the caller's own
+    cont.items.append(Item(2))
+    cont.items.remove(cont.items[0])
+    assert len(cont) == len(cont.items) == 2 and Item(2) not in cont
+
+def test_container_bulk_operations():
+    """ Batch additions, removals and transfers are all-or-nothing """
+    bank = Container(max_capacity=4, container_name='bank')
+    coins = Item(0, count=5)
+    result = bank.add_many([coins, Item(2), Item(0, count=3), Item(1)])
+    assert result.success
+    assert len(bank) == 3
+    assert bank.items[0]._count == 8
+    # The caller's items aren't stored, so later changes don't reach them
+    bank.append(Item(0, count=10))
+    assert coins._count == 5 and result.items[0]._count == 5
+    bank.remove_many([Item(0, count=10)])
+
+    assert not bank.add_many([Item(1), Item(2)]).success
+    assert len(bank) == 3
+
+    assert not bank.remove_many([Item(0, count=9)]).success
+    result = bank.remove_many([Item(0, count=2), Item(2)])
+    assert result.success
+    assert bank.items[0]._count == 6
+    assert Item(2) not in bank
+
+    inv = Inventory(max_capacity=1)
+    assert not Container.transfer(bank, inv, [Item(0, count=1), Item(1)]).success
+    assert bank.items[0]._count == 6 and len(inv) == 0
+    result = Container.transfer(bank, inv, [Item(0, count=6)])
+    assert result.success
+    assert Item(0) not in bank
+    assert inv.items[0]._count == 6
+    inv.append(Item(0, count=100))
+    assert result.items[0]._count == 6
+    inv.remove(Item(0), count=100)
+
+    # Stack sizes must be positive, or items could be conjured or taken the wrong way
+    bank.add_many([Item(0, count=5)])
+    for result in (bank.add_many([Item(0, count=-100)]), bank.remove_many([Item(0, count=-10)]),
+                   Container.transfer(bank, inv, [Item(0, count=-40)]), bank.add_many([Item(0, count=0)])):
+        assert not result.success
+    assert bank.to_multiset()[Item(0)] == 5 and inv.items[0]._count == 6
+
+def test_compact_container():
+    """ The array-backed container behaves like a regular one """
+    bank = CompactContainer(max_capacity=100)
+    for i in range(10):
+        bank.append(Item(2, meta=i))
+    bank.append(Item(0, count=7))
+    bank.append(Item(0, count=3))
+    assert len(bank) == 11
+    assert bank.items[-1]._count == 10
+    assert bank.items[:3] == [Item(2, meta=0), Item(2, meta=1), Item(2, meta=2)]
+
+    bank.items[-1]._count += 5
+    assert bank.remove(Item(0), count=15) == f"{Item(0).name} was successfully removed"
+    for i in range(8):
+        bank.remove(Item(2, meta=i))
+    assert bank.items == [Item(2, meta=8), Item(2, meta=9)]
+    assert Item(2, meta=9) in bank and Item(2, meta=0) not in bank
+
+    # Items read from the bank don't keep pointing into it once stored elsewhere
+    bank.append(Item(0, count=3))
+    inv = Inventory()
+    inv.append(bank.items[-1])
+    inv.append(Item(0, count=10))
+    assert inv.items[0]._count == 13 and bank.items[-1]._count == 3
+    bank.items = list(reversed(bank.items))
+    assert bank.items == [Item(0, count=3), Item(2, meta=9), Item(2, meta=8)]
+
+    # Stacks hold as much as a regular container's, and a failed add leaves the bank intact
+    bank.set_count(Item(0), 2_500_000_000)
+    assert bank.items[0]._count == 2_500_000_000
+    try:
+        bank.append(Item(0, meta='huge', count=2**64))
+    except OverflowError:
+        pass
+    else:
+        raise AssertionError("Stacks over the array limit should be rejected")
+    assert len(bank.items) == len(bank) == 3
+
+def test_container_sort_compact():
+    """ Fragmented stacks are merged and slots are reordered stably """
+    for cls in (Container, CompactContainer):
+        bank = cls(items=[Item(2, meta=1), Item(0, count=3), Item(1), Item(0, count=4), Item(2, meta=0)],
+                   max_capacity=10)
+        assert bank.compact() == 1
+        assert bank.items == [Item(2, meta=1), Item(0), Item(1), Item(2, meta=0)]
+        assert bank.items[1]._count == 7
+        assert bank.compact() == 0
+
+        bank.append(Item(0, count=2))
+        assert bank.sort()
+        assert bank.items == [Item(0), Item(1), Item(2, meta=1), Item(2, meta=0)]
+        assert bank.items[0]._count == 9
+        assert not bank.sort()
+        assert bank.sort(key=lambda item: item.name, reverse=True)
+        assert [item.ID for item in bank.items] == [1, 2, 2, 0]
+
+def test_container_journal():
+    """ Replaying the journal reproduces the container; old changes can be dropped """
+    for cls in (Container, CompactContainer):
+        bank = cls(items=[Item(0, count=5), Item(1)], max_capacity=10, journal_limit=50)
+        start = bank.sequence
+        bank.append(Item(0, count=2))
+        bank.append(Item(2, meta=1))
+        bank.remove(Item(1))
+        bank.remove_many([Item(0, count=3)])
+        bank.sort()
+
+        replica = {}
+        for change in bank.changes_since(0):
+            if change.kind == 'clear':
+                replica.clear()
+            elif change.kind == 'add':
+                replica[change.slot] = change.value
+            elif change.kind == 'remove':
+                del replica[change.slot]
+            elif change.kind == 'count':
+                replica[change.slot][1] = change.value
+        assert list(replica.values()) == bank.to_state()['items']
+        assert [change.kind for change in bank.changes_since(start)][:3] == ['count', 'add', 'remove']
+        assert bank.changes_since(bank.sequence) == []
+
+        assert bank.compact_journal(start) == start
+        assert bank.changes_since(0) is None
+        assert bank.changes_since(start)[0].seq == start + 1
+        for _ in range(60):
+            bank.append(Item(0))
+        assert bank.changes_since(start) is None
+
+    inv = Inventory(items=[Item(1)])
+    seq = inv.sequence
+    inv.equip(Item(1))
+    assert [(change.kind, change.slot) for change in inv.changes_since(seq)] == [('gear', 'weapon'), ('remove', 0)]
+
+    # Without a journal, nothing is recorded and callers always resync
+    quiet = Container(journal_limit=0)
+    with mock.patch.object(Item, 'to_state', side_effect=AssertionError("Nothing should be recorded")):
+        quiet.append(Item(0))
+    assert quiet.sequence == 0 and quiet.changes_since(0) is None
+
+def test_inv_clone():
+    """ Clones share their storage until one of them is modified """
+    for cls in (Container, CompactContainer):
+        bank = cls(items=[Item(0, count=5), Item(1)], max_capacity=10)
+        copy = bank.clone()
+        assert copy.items == bank.items and copy.to_state() == bank.to_state()
+        copy.append(Item(0, count=3))
+        copy.remove(Item(1))
+        bank.append(Item(2))
+        assert bank.to_state()['items'] == [[0, 5, None], [1, None, None], [2, None, None]]
+        assert copy.to_state()['items'] == [[0, 8, None]]
+
+        # Consolidating stacks doesn't reach into a clone's items either
+        bank = cls(items=[Item(0, count=3), Item(1), Item(0, count=4)])
+        copy = bank.clone()
+        bank.compact()
+        assert bank.to_state()['items'] == [[0, 7, None], [1, None, None]]
+        assert copy.to_state()['items'] == [[0, 3, None], [1, None, None], [0, 4, None]]
+
+    layout = GearLayout.get(["weapon", "head"])
+    assert GearLayout.get(("weapon", "head")) is layout
+    inv = Inventory(layout=layout, gear={"weapon": Item(1), "head": None}, items=[Item(0, count=4)])
+    clones = [inv.clone() for _ in range(3)]
+    clones[0].unequip("weapon")
+    clones[1].append(Item(0))
+    assert inv.gear["weapon"] == Item(1) and inv.total_attack == 5
+    assert clones[0].gear["weapon"] is None and clones[0].total_attack == 0
+    assert clones[0].items == [Item(0), Item(1)]
+    assert inv.items[0]._count == 4 and clones[1].items[0]._count == 5
+    assert clones[2].to_state() == inv.to_state()
+    assert Inventory.from_state(inv.to_state()).layout is layout
+    restored = pickle.loads(pickle.dumps(inv))
+    assert restored.layout is layout and restored.to_state() == inv.to_state()
+
+def test_container_thread_safety():
+    """ Concurrent transfers between shared containers never lose or duplicate items """
+    banks = [Container(items=[Item(0, count=1000)], max_capacity=8, thread_safe=True) for _ in range(4)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def trader(seed):
+        for i in range(500):
+            src, dst = banks[(seed + i) % 4], banks[(seed * 3 + i + 1) % 4]
+            Container.transfer(src, dst, [Item(0, count=7)])
+            dst.remove(Item(0), count=1)
+            src.append(Item(0))
+
+    try:
+        threads = [threading.Thread(target=trader, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert sum(bank.items[0]._count for bank in banks if bank.items) == 4000
+    assert all(len(bank) <= 1 for bank in banks)
+
+    # Copies of a thread-safe container get a lock of their own
+    for copy in (pickle.loads(pickle.dumps(banks[0])), deepcopy(banks[0])):
+        assert copy.to_state() == banks[0].to_state()
+        assert copy._lock is not banks[0]._lock and copy._lock is not NO_LOCK
+    player = Player("Courier", Inventory(thread_safe=True), registry=None)
+    assert pickle.loads(pickle.dumps(player)).inventory._lock is not NO_LOCK
+
 @initialiser
 def test_inv_equip_unequip(items, inv, *args, **kwargs):
     """ Test for inventory item equip/unequip functionality """
@@ -73,6 +379,31 @@ def test_inv_equip_unequip(items, inv, *args, **kwargs):
     assert inv.gear['head'] is None
     assert inv.gear['weapon'] is None
 
+@initialiser
+def test_inv_gear_stats(items, inv, *args, **kwargs):
+    """ Gear stat totals follow equipping and unequipping """
+    assert (inv.total_attack, inv.total_defence) == (0, 0)
+    inv.append(Item(3))
+    inv.append(Item(5))
+    inv.equip(Item(1))
+    inv.equip(Item(3))
+    assert (inv.total_attack, inv.total_defence) == (5, 15)
+    assert inv.slot_stats['head'] == (0, 12)
+
+    inv.equip_from_index(inv.items.index(Item(5)))
+    assert (inv.total_attack, inv.total_defence) == (6, 15)
+    inv.unequip('head')
+    assert (inv.total_attack, inv.total_defence) == (6, 3)
+    assert Inventory.from_state(inv.to_state()).total_attack == 6
+
+    # Gear can only change through the inventory, so the totals can't go stale
+    try:
+        inv.gear['weapon'] = Item(1)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("Gear should be read-only")
+
 @initialiser
 def test_inv_combine(items, inv, *args, **kwargs):
     """ Test for item combining functionality """
@@ -81,6 +412,20 @@ def test_inv_combine(items, inv, *args, **kwargs):
     assert inv.better_combine_item(inv.items[0], 0, inv.items[1]) == "Could not combine those items"
     assert len(inv) == 2
 
+def test_inv_craft():
+    """ Craftable recipes are found from item counts and crafted in one batch """
+    inv = Inventory(items=[Item(1), Item(1), Item(1), Item(2, meta='shiny'), Item(2), Item(0)])
+    recipe = Recipe(base=1, combination=0, materials=(2,), result=5)
+    assert inv.craftable_recipes() == [recipe]
+    assert RecipeIndex.get().lookup([2, 1]) == [recipe]
+
+    result = inv.craft_max(recipe)
+    assert result.success
+    assert len(result.items) == 2
+    assert inv.item_counts() == {0: 1, 1: 1, 5: 2}
+    assert inv.craftable_recipes() == []
+    assert not inv.craft_max(recipe).success
+
 def test_char_levelmixin():
     """ Test for level-up functionality """
     char = Character('John Doe', max_level = 5)
@@ -92,3 +437,41 @@ def test_char_levelmixin():
         char.give_exp(char.next_level)
     assert char.level == char.max_level
     assert char.give_exp(char.next_level) == f""
+
+def test_char_levelmixin_bulk():
+    """ Large and batched EXP grants match levelling up one level at a time """
+    chars = [Character('John Doe', max_level=50), Character('Jane Doe'), Character('Jim Doe', exponent=2)]
+    amounts = [10**9, 123456, 85]
+    expected = []
+    for char, amount in zip(chars, amounts):
+        level = char.level
+        while char.next_level <= amount and level != char.max_level:
+            level += 1
+            char.level = level
+        expected.append(level)
+        char.level = 1
+
+    assert Character.give_exp_many(chars, amounts) == [level - 1 for level in expected]
+    assert [char.level for char in chars] == expected
+    assert chars[0].level == chars[0].max_level
+
+def test_state_roundtrip():
+    """ Players survive a binary round trip, and inventory state is only rebuilt when dirty """
+    player = Player('Jane Doe', level=3, exp=500)
+    player.inventory.append(Item(0, count=50))
+    player.inventory.append(Item(1, meta={'engraving': 'JD'}))
+    player.inventory.equip(Item(1, meta={'engraving': 'JD'}))
+
+    restored = Player.from_bytes(player.to_bytes())
+    assert isinstance(restored, Player)
+    assert restored.to_state() == player.to_state()
+    assert restored.inventory.gear['weapon'] == Item(1, meta={'engraving': 'JD'})
+    assert not restored.inventory.dirty
+
+    state = player.inventory.to_state()
+    assert player.inventory.to_state() is state
+    player.inventory.mark_clean()
+    player.inventory.remove(Item(0), count=5)
+    assert player.inventory.dirty
+    assert player.inventory.to_state() is not state
+    assert player.inventory.to_state()['items'][0] == [0, 45, None]
@@ -0,0 +1,145 @@
+#! python3
+
+""" Pytest-compatible tests for src/dataindex.py """
+
+import sys
+import json
+
+from pathlib import Path
+from unittest import mock
+
+# A workaround for tests not automatically setting
+# root/src/ as the current working directory
+path_to_src = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(path_to_src))
+
+from dataindex import scan, validate, build_index, index_path
+from mixins import DataCatalog
+from settings import *
+
+
+ITEMS = {"items": {
+    "0": {"name": "Coins é", "type": "item", "stackable": True, "examine": ["{[\"", "}"]},
+    "1": {"name": "Wooden sword", "type": "weapon", "examine": "Dull.", "atk": 5, "combine2": [[2, 5]]},
+    "2": {"name": "Pebble", "type": "item", "examine": "A rock."},
+    "5": {"name": "Sharpened wooden sword", "type": "weapon", "examine": "Sharp."},
+}}
+
+
+def test_scan_json(tmp_path):
+    """ Records are found at their exact byte offsets, whatever the chunk size """
+    file = tmp_path / "items.json"
+    file.write_text(json.dumps(ITEMS, indent=2, ensure_ascii=False), encoding="utf-8")
+    data = file.read_bytes()
+    for chunk_size in (1, 7, 1 << 16):
+        records = list(scan(str(file), 'json', chunk_size))
+        assert [record.ID for record in records] == ["0", "1", "2", "5"]
+        for record in records:
+            assert data[record.offset:record.offset + len(record.raw)] == record.raw
+            assert json.loads(record.raw.decode()) == ITEMS["items"][record.ID]
+
+def test_scan_toml():
+    """ TOML records include their sub-tables """
+    records = {record.ID: record for record in scan(str(DATA_DIR / "objects.toml"), 'toml')}
+    assert sorted(records) == ["0", "1"]
+    assert b"[barrier.1.open]" in records["1"].raw
+
+def test_scan_toml_headers(tmp_path):
+    """ Quoted and indented headers start records; arrays and strings that look like headers don't """
+    file = tmp_path / "items.toml"
+    file.write_text('[items]\n'
+                    '  [items."1"]  # Indented, quoted\n'
+                    'name = "Wooden sword"\n'
+                    'combine2 = [\n'
+                    '  [2]\n'
+                    ']\n'
+                    'examine = """\n'
+                    '[items.3]\n'
+                    '"""\n'
+                    "[ items . '2' ]\n"
+                    'name = "Pebble"\n')
+    records = list(scan(str(file), 'toml'))
+    assert [record.ID for record in records] == ["1", "2"]
+    assert b"[items.3]" in records[0].raw
+
+    catalog = DataCatalog(pack_file=None)
+    build_index(str(file), 'toml')
+    assert catalog.get(1, 'items', str(file), 'toml')['combine2'] == [[2]]
+    assert catalog.get(2, 'items', str(file), 'toml')['name'] == "Pebble"
+
+    # A header that can't be read is reported, and no index is written for the file
+    broken_file = tmp_path / "broken.toml"
+    broken_file.write_text('[items.1]\nname = "Wooden sword"\n[items.2 extra]\nname = "Pebble"\n')
+    problems = validate([str(broken_file)], write_index=True)
+    assert [(problem.section, problem.message.split(" ")[0]) for problem in problems] == [(None, "Unsupported")]
+    assert not Path(index_path(str(broken_file))).exists()
+
+def test_validate(tmp_path):
+    """ Schema problems and dangling item references are reported """
+    items = json.loads(json.dumps(ITEMS))
+    items["items"]["1"]["combine2"].append([2, 9])
+    items["items"]["2"]["type"] = "hat"
+    del items["items"]["5"]["name"]
+    item_file = tmp_path / "items.json"
+    item_file.write_text(json.dumps(items))
+    enemy_file = tmp_path / "enemies.json"
+    enemy_file.write_text(json.dumps({"enemies": {"0": {"name": "Rat", "level": 3, "loot": [{"item": 7}]}}}))
+    broken_file = tmp_path / "broken.json"
+    broken_file.write_text('{"items": {"0": {"name": "Unfinished"')
+
+    problems = validate([str(item_file), str(enemy_file), str(broken_file)])
+    found = {(Path(problem.file).name, problem.section, problem.ID, problem.message.split(" ")[0])
+             for problem in problems}
+    assert found == {
+        ("items.json", "items", "2", "'type'"),
+        ("items.json", "items", "5", "missing"),
+        ("items.json", "items", "1", "combine2"),
+        ("enemies.json", "enemies", "0", "loot"),
+        ("broken.json", None, None, "Unexpected"),
+    }
+    assert "9" in next(problem.message for problem in problems if problem.ID == "1")
+    assert validate([str(DATA_DIR / "items.json")]) == []
+
+    # Records of the wrong shape are reported rather than crashing the validator
+    malformed_file = tmp_path / "malformed.json"
+    malformed_file.write_text(json.dumps({
+        "items": {"0": {"name": "Coins", "type": "item", "examine": "Money.", "combine2": 5},
+                  "1": {"name": "Coins", "type": "item", "stackable": True, "examine": "Money."},
+                  "2": {"name": "Rock", "type": "item"}},
+        "enemies": {"0": {"name": "Rat", "level": 1, "loot": [{"item": 0, "min": "1"}]},
+                    "1": {"name": "Bat", "level": 1, "loot": {"item": 0}}},
+        "quests": {"0": {"name": "Rats!", "rewards": [[0, 10]]}},
+    }))
+    found = {(problem.section, problem.ID, problem.message) for problem in validate([str(malformed_file)])}
+    assert found == {
+        ("items", "0", "'combine2' is not an array"),
+        ("items", "1", "stackable items need 'examine' to be a pair of strings"),
+        ("items", "2", "missing or non-string 'examine'"),
+        ("enemies", "0", "loot entry {'item': 0, 'min': '1'} has a non-integer stack size"),
+        ("enemies", "1", "'loot' is not an array"),
+        ("quests", "0", "'rewards' is not a table"),
+    }
+
+def test_catalog_uses_index(tmp_path):
+    """ With an up-to-date index, records are read without parsing the whole file """
+    file = tmp_path / "items.json"
+    file.write_text(json.dumps({"items": {str(i): {"name": f"Item {i}"} for i in range(50)}}))
+    assert build_index(str(file), 'json') == index_path(str(file))
+    catalog = DataCatalog(pack_file=None)
+
+    with mock.patch.object(DataCatalog, '_parse', wraps=DataCatalog._parse) as parse:
+        for i in range(50):
+            assert catalog.get(i, 'items', str(file), 'json')['name'] == f"Item {i}"
+        assert catalog.get(7, 'items', str(file), 'json') is catalog.get(7, 'items', str(file), 'json')
+        try:
+            catalog.get(50, 'items', str(file), 'json')
+        except KeyError:
+            pass
+        else:
+            raise AssertionError("Missing IDs should raise KeyError")
+        assert parse.call_count == 0
+
+    # Once the file changes, the index is out of date
+    file.write_text(json.dumps({"items": {"0": {"name": "Newer"}}}))
+    catalog.refresh()
+    assert catalog.get(0, 'items', str(file), 'json')['name'] == "Newer"
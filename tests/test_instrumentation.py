@@ -0,0 +1,56 @@
+#! python3
+
+""" Pytest-compatible tests for src/instrumentation.py """
+
+import io
+import sys
+
+from pathlib import Path
+
+# A workaround for tests not automatically setting
+# root/src/ as the current working directory
+path_to_src = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(path_to_src))
+
+import instrumentation
+
+from classes import Item, Container, CompactContainer, Inventory
+
+
+def test_instrumentation_toggle():
+    """ Metrics are only collected while instrumentation is enabled """
+    original = Container.__dict__['append']
+    instrumentation.reset()
+    instrumentation.enable()
+    try:
+        cont = Container()
+        for _ in range(3):
+            cont.append(Item(2))
+        Container.transfer(cont, Container(), [Item(2)])
+        bank = CompactContainer(items=[Item(2)])
+        bank.remove(Item(2))
+        inv = Inventory(items=[Item(1)])
+        inv.equip(Item(1))
+    finally:
+        instrumentation.disable()
+    assert Container.__dict__['append'] is original
+
+    metrics = instrumentation.snapshot()
+    assert metrics['Container.append']['count'] == 3
+    assert sum(metrics['Container.append']['histogram'].values()) == 3
+    assert metrics['Container.transfer']['count'] == 1
+    # Nested calls only count towards the outermost operation
+    assert metrics['CompactContainer.remove']['count'] == 1 and metrics['Inventory.equip']['count'] == 1
+    assert metrics['Container.remove']['count'] == 0
+    assert metrics['data.hits'] + metrics['data.misses'] == metrics['data.lookups']['count']
+    assert metrics['data.misses'] == metrics['data.cache']['misses']
+
+    cont.append(Item(2))
+    assert instrumentation.snapshot()['Container.append']['count'] == 3
+
+def test_profile():
+    """ The profiler reports on the profiled block """
+    stream = io.StringIO()
+    with instrumentation.profile(limit=5, stream=stream):
+        Item(0)
+    assert "function calls" in stream.getvalue()
@@ -0,0 +1,67 @@
+#! python3
+
+""" Pytest-compatible tests for src/loot.py """
+
+import sys
+import json
+import random
+
+from pathlib import Path
+
+# A workaround for tests not automatically setting
+# root/src/ as the current working directory
+path_to_src = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(path_to_src))
+
+from loot import LootTable, roll
+from classes import Item, Container, CompactContainer
+from settings import *
+
+
+def test_alias_table():
+    """ The alias columns reproduce the entry weights exactly """
+    weights = [5, 1, 0.5, 3.5]
+    probability, alias = LootTable._build_alias(weights)
+    chances = [0.0] * len(weights)
+    for column in range(len(weights)):
+        chances[column] += probability[column] / len(weights)
+        chances[alias[column]] += (1 - probability[column]) / len(weights)
+    for chance, weight in zip(chances, weights):
+        assert abs(chance - weight / sum(weights)) < 1e-9
+
+def test_loot_roll(tmp_path, monkeypatch):
+    """ Rolls follow the weights and stack sizes of the enemy data """
+    enemy_file = tmp_path / "enemies.json"
+    enemy_file.write_text(json.dumps({"enemies": {
+        "0": {"name": "Slime block", "level": 2},
+        "1": {"name": "Giant rat", "level": 3, "lootRolls": 2, "loot": [
+            {"item": 0, "weight": 3, "min": 1, "max": 5},
+            {"item": 2, "weight": 1},
+            {"weight": 6},
+        ]},
+    }}))
+    assert roll(0, 100, file=str(enemy_file)) == []
+
+    for threshold in (10**9, 1):
+        monkeypatch.setattr(LootTable, 'NUMPY_THRESHOLD', threshold)
+        drops = dict(roll(1, 20000, random.Random(3), file=str(enemy_file)))
+        # 40000 rolls: 30% coins (3 on average), 10% pebbles
+        assert abs(drops[0] - 36000) < 1500
+        assert abs(drops[2] - 4000) < 400
+        assert roll(1, 500, random.Random(7), file=str(enemy_file)) == \
+            roll(1, 500, random.Random(7), file=str(enemy_file))
+
+    # The shipped enemy data works out of the box
+    assert {ID for ID, _ in roll(1, 1000, random.Random(1))} == {0, 2}
+
+def test_add_counts():
+    """ Rolled loot goes straight into containers, merging with existing stacks """
+    for cls in (Container, CompactContainer):
+        bank = cls(items=[Item(0, count=10)], max_capacity=3)
+        result = bank.add_counts([(0, 25), (2, 2), (0, 5)])
+        assert result.success and result.items == [Item(2), Item(2)]
+        assert bank.items[0]._count == 40
+        assert len(bank) == 3
+        assert not bank.add_counts([(1, 1)]).success
+        assert bank.add_counts([(0, 1)]).success
+        assert bank.items[0]._count == 41
@@ -0,0 +1,214 @@
+#! python3
+
+""" Pytest-compatible tests for src/mixins.py """
+
+import os
+import sys
+import json
+import asyncio
+import threading
+
+from pathlib import Path
+from unittest import mock
+
+# A workaround for tests not automatically setting
+# root/src/ as the current working directory
+path_to_src = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(path_to_src))
+
+from mixins import CATALOG, DataCatalog, LRUCache, LFUCache, SpriteRegistry, make_cache, preload
+from datapack import build_pack
+from settings import *
+
+
+def test_catalog_parses_once(tmp_path):
+    """ A data file is parsed only once, however many IDs are requested """
+    file = tmp_path / "items.json"
+    file.write_text(json.dumps({"items": {str(i): {"name": f"Item {i}"} for i in range(100)}}))
+    catalog = DataCatalog()
+
+    with mock.patch.object(DataCatalog, '_parse', wraps=DataCatalog._parse) as parse:
+        for i in range(100):
+            assert catalog.get(i, 'items', str(file), 'json')['name'] == f"Item {i}"
+        assert parse.call_count == 1
+
+def test_catalog_invalidation(tmp_path):
+    """ A changed data file is parsed again once it is checked """
+    file = tmp_path / "items.json"
+    file.write_text(json.dumps({"items": {"0": {"name": "Old"}}}))
+    catalog = DataCatalog(check_interval=None)
+    assert catalog.get(0, 'items', str(file), 'json')['name'] == "Old"
+
+    # Lookups don't touch the disk between checks
+    file.write_text(json.dumps({"items": {"0": {"name": "Newer"}}}))
+    with mock.patch('os.stat', side_effect=AssertionError("Lookups shouldn't stat files")):
+        assert catalog.get(0, 'items', str(file), 'json')['name'] == "Old"
+    catalog.refresh()
+    assert catalog.get(0, 'items', str(file), 'json')['name'] == "Newer"
+
+    catalog.check_interval = 0
+    file.write_text(json.dumps({"items": {"0": {"name": "Newest"}}}))
+    assert catalog.get(0, 'items', str(file), 'json')['name'] == "Newest"
+
+    catalog.invalidate(str(file))
+    assert str(file) not in catalog
+
+def test_preload(tmp_path):
+    """ Preloading parses data files ahead of the first lookup """
+    files = []
+    for name in ("items.json", "enemies.json"):
+        file = tmp_path / name
+        file.write_text(json.dumps({"items": {"0": {"name": name}}}))
+        files.append(str(file))
+    preload(files).join()
+    assert all(file in CATALOG for file in files)
+
+def test_catalog_async_coalescing(tmp_path):
+    """ Concurrent asynchronous lookups of a cold file share one parse """
+    file = tmp_path / "items.json"
+    file.write_text(json.dumps({"items": {str(i): {"name": f"Item {i}"} for i in range(200)}}))
+    catalog = DataCatalog()
+
+    async def lookup_all():
+        return await asyncio.gather(*(catalog.aget(i, 'items', str(file), 'json') for i in range(200)))
+
+    loop = asyncio.new_event_loop()
+    try:
+        with mock.patch.object(DataCatalog, '_parse', wraps=DataCatalog._parse) as parse:
+            results = loop.run_until_complete(lookup_all())
+            assert parse.call_count == 1
+    finally:
+        loop.close()
+    assert [data['name'] for data in results] == [f"Item {i}" for i in range(200)]
+
+def test_catalog_data_pack(tmp_path):
+    """ Objects are read from an up-to-date data pack without parsing the source """
+    file = tmp_path / "items.json"
+    file.write_text(json.dumps({"items": {str(i): {"name": f"Item {i}"} for i in range(50)}}))
+    pack = tmp_path / "data.pack"
+    build_pack([str(file)], str(pack), 'json')
+    catalog = DataCatalog(pack_file=str(pack))
+
+    with mock.patch.object(DataCatalog, '_parse', wraps=DataCatalog._parse) as parse:
+        for i in range(50):
+            assert catalog.get(i, 'items', str(file), 'json')['name'] == f"Item {i}"
+        assert catalog.get(7, 'items', str(file), 'json') is catalog.get(7, 'items', str(file), 'json')
+        try:
+            catalog.get(50, 'items', str(file), 'json')
+        except KeyError:
+            pass
+        else:
+            raise AssertionError("Missing IDs should raise KeyError")
+        assert parse.call_count == 0
+
+    # Files of the same name elsewhere aren't served from the pack
+    try:
+        catalog.get(0, 'items', str(tmp_path / "mods" / "items.json"), 'json')
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError("Only the files the pack was built from should be read from it")
+
+    # Once the source changes, the pack is out of date
+    file.write_text(json.dumps({"items": {"0": {"name": "Newer"}}}))
+    catalog.refresh()
+    assert catalog.get(0, 'items', str(file), 'json')['name'] == "Newer"
+
+def test_cache_policies():
+    """ LRU forgets the stalest record, LFU the least used one """
+    for cls, survivor in ((LRUCache, 'a'), (LFUCache, 'b')):
+        cache = cls(maxsize=2)
+        cache.put(('f', 's', 'a'), 'a')
+        cache.put(('f', 's', 'b'), 'b')
+        cache.get(('f', 's', 'b'))
+        cache.get(('f', 's', 'b'))
+        cache.get(('f', 's', 'a'))
+        cache.put(('f', 's', 'c'), 'c')
+        assert ('f', 's', survivor) in cache and ('f', 's', 'c') in cache and len(cache) == 2
+        assert cache.stats()['evictions'] == 1
+        assert cache.get(('f', 's', 'x')) is None
+        assert cache.stats()['hit_ratio'] == 0.75
+    try:
+        make_cache(10, 'fifo')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Unknown policies should be rejected")
+
+def test_catalog_cache(tmp_path):
+    """ The record cache is bounded, can be warmed and is invalidated per file and section """
+    file = tmp_path / "items.json"
+    file.write_text(json.dumps({"items": {str(i): {"name": f"Item {i}"} for i in range(50)},
+                                "enemies": {"0": {"name": "Rat"}}}))
+    catalog = DataCatalog(pack_file=None, cache=make_cache(10, 'lfu'))
+    assert catalog.warm([1, 2, 3, 99], 'items', str(file), 'json') == 3
+    assert catalog.cache.stats()['misses'] == 4
+    for i in range(50):
+        assert catalog.get(i, 'items', str(file), 'json')['name'] == f"Item {i}"
+    assert len(catalog.cache) == 10
+    assert catalog.cache.hits == 3
+
+    catalog.get(0, 'enemies', str(file), 'json')
+    catalog.invalidate(str(file), 'items')
+    assert catalog.cache.keys() == [(str(file), 'enemies', '0')]
+    assert str(file) in catalog
+
+    # A changed file clears its records
+    file.write_text(json.dumps({"enemies": {"0": {"name": "Bigger rat"}}}))
+    catalog.refresh(str(file))
+    assert catalog.get(0, 'enemies', str(file), 'json')['name'] == "Bigger rat"
+
+def test_catalog_cache_threads(tmp_path):
+    """ Threads sharing a catalog don't corrupt its record cache """
+    file = tmp_path / "items.json"
+    file.write_text(json.dumps({"items": {str(i): {"name": f"Item {i}"} for i in range(256)}}))
+    errors = []
+
+    def lookups(catalog):
+        try:
+            for n in range(2000):
+                i = (n * 7919) % 256
+                assert catalog.get(i, 'items', str(file), 'json')['name'] == f"Item {i}"
+        except Exception as e:
+            errors.append(e)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for cache in (LFUCache(64), LRUCache(64)):
+            catalog = DataCatalog(pack_file=None, cache=cache)
+            threads = [threading.Thread(target=lookups, args=(catalog,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert errors == []
+            assert len(cache) == 64
+            assert cache.hits + cache.misses == 8 * 2000
+    finally:
+        sys.setswitchinterval(interval)
+
+def test_sprite_registry(tmp_path):
+    """ Sprite directories are scanned once, and again after they or their subdirectories change """
+    sprite_dir = tmp_path / "chars" / "hero"
+    sprite_dir.mkdir(parents=True)
+    (sprite_dir / "idle.png").touch()
+    registry = SpriteRegistry(tmp_path)
+
+    with mock.patch.object(Path, 'glob', autospec=True, side_effect=Path.glob) as glob:
+        assert len(registry.get('chars', 'hero')) == 1
+        assert len(registry.get('chars', 'hero')) == 1
+        assert glob.call_count == 1
+
+    os.utime(sprite_dir, ns=(0, 0))
+    (sprite_dir / "walk.png").touch()
+    os.utime(sprite_dir, ns=(1, 1))
+    assert len(registry.get('chars', 'hero')) == 2
+    assert registry.get('chars', 'villain') == []
+
+    # Changes in subdirectories are noticed too
+    (sprite_dir / "attack").mkdir()
+    assert len(registry.get('chars', 'hero')) == 3
+    os.utime(sprite_dir / "attack", ns=(0, 0))
+    (sprite_dir / "attack" / "swing.png").touch()
+    assert len(registry.get('chars', 'hero')) == 4
@@ -0,0 +1,98 @@
+#! python3
+
+""" Pytest-compatible tests for src/registry.py """
+
+import gc
+import sys
+import pickle
+import threading
+
+from pathlib import Path
+
+# A workaround for tests not automatically setting
+# root/src/ as the current working directory
+path_to_src = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(path_to_src))
+
+from registry import EntityRegistry, WORLD
+from classes import Item, Inventory, Character, Player
+from mixins import LevelMixin
+from settings import *
+
+
+def test_registry_indexes():
+    """ Names, levels and held items are indexed as the characters change """
+    registry = EntityRegistry()
+    rats = [Character("Giant rat", level=3, registry=registry) for _ in range(5)]
+    hero = Player("Hero", level=1, registry=registry)
+    assert len(registry) == 6 and hero in registry
+    assert registry.named("Giant rat") == rats
+    assert registry.in_level_range(low=3) == rats
+
+    hero.give_exp(10**4)
+    LevelMixin.give_exp_many(rats[:2], [10**6, 0])
+    assert registry.at_level(1) == []
+    assert registry.in_level_range(low=hero.level) == sorted([hero, rats[0]], key=lambda c: c.level)
+    assert registry.in_level_range(high=3) == rats[1:]
+
+    hero.name = "Champion"
+    assert registry.named("Hero") == [] and registry.named("Champion") == [hero]
+
+    hero.inventory.append(Item(0, count=5))
+    hero.inventory.append(Item(1))
+    rats[0].inventory.add_counts([(0, 3)])
+    assert registry.holding(0) == [hero, rats[0]]
+    hero.inventory.equip(Item(1))
+    assert registry.holding(1) == [hero]
+    hero.inventory.unequip("weapon")
+    hero.inventory.remove(Item(1))
+    hero.inventory.remove(Item(0), count=5)
+    assert registry.holding(1) == [] and registry.holding(0) == [rats[0]]
+
+    rats[0].inventory.clone().append(Item(2))
+    assert registry.holding(2) == []
+
+def test_registry_weak_references():
+    """ Characters leave the registry when they are garbage collected """
+    registry = EntityRegistry()
+    character = Character("Slime block", level=2, registry=registry)
+    character.inventory.append(Item(2))
+    del character
+    gc.collect()
+    assert len(registry) == 0
+    assert registry.named("Slime block") == [] and registry.holding(2) == []
+    assert registry.in_level_range() == []
+
+    assert Character("Ghost", registry=None) not in WORLD
+
+def test_registry_threads():
+    """ Thread-safe inventories can update the registry from several threads """
+    registry = EntityRegistry()
+    characters = [Character(f"Guard {i}", Inventory(thread_safe=True), registry=registry) for i in range(4)]
+
+    def shuffle(character):
+        for _ in range(300):
+            character.inventory.append(Item(1))
+            character.inventory.append(Item(2))
+            character.inventory.remove(Item(1))
+        character.inventory.remove(Item(2))
+
+    threads = [threading.Thread(target=shuffle, args=(character,)) for character in characters * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry.holding(1) == []
+    assert sorted(registry.holding(2), key=characters.index) == characters
+
+def test_registry_pickling():
+    """ Unpickled characters rejoin WORLD, but not other registries """
+    character = Character("Wanderer")
+    character.inventory.append(Item(2))
+    copy = pickle.loads(pickle.dumps(character))
+    assert copy in WORLD and copy in WORLD.holding(2)
+
+    registry = EntityRegistry()
+    hermit = Character("Hermit", registry=registry)
+    copy = pickle.loads(pickle.dumps(hermit))
+    assert copy not in WORLD and copy not in registry and hermit in registry
@@ -0,0 +1,36 @@
+#! python3
+
+""" Pytest-compatible tests for src/simulation.py """
+
+import sys
+import json
+
+from pathlib import Path
+
+# A workaround for tests not automatically setting
+# root/src/ as the current working directory
+path_to_src = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(path_to_src))
+
+from simulation import run_simulation
+from settings import *
+
+
+def test_simulation_processes(tmp_path):
+    """ A multiprocess run gives the same results as a single-process one """
+    enemy_file = tmp_path / "enemies.json"
+    enemy_file.write_text(json.dumps({"enemies": {
+        "0": {"name": "Slime block", "level": 2},
+        "1": {"name": "Vincent the Keen-Eyed", "level": 13, "canLevelUp": True},
+    }}))
+    options = dict(population=300, enemy_ids=[0, 1], ticks=5, exp_range=(100, 5000),
+                   loot=[(2, 0.5), (0, 0.25)], batch_size=50, seed=42, enemy_file=str(enemy_file))
+
+    single = run_simulation(processes=1, **options)
+    multi = run_simulation(processes=2, **options)
+
+    assert vars(single) == vars(multi)
+    assert single.characters == 300
+    assert single.levels[2] == 150
+    assert single.levels_gained > 0
+    assert sum(single.drops.values()) + single.lost_drops > 0